@@ -11,8 +11,7 @@ import sys
 import os
 sys.path.append(os.path.join(os.path.dirname(__file__), '..'))
 
-from src.core.database import Base
-from src.core.config import settings
+from src.core.database import Base, database_url
 
 # Import all models so Alembic can see them
 from src.models import User, Child, Story, StorySeries, ChildPreferences
@@ -21,8 +20,9 @@ from src.models import User, Child, Story, StorySeries, ChildPreferences
 # access to the values within the .ini file in use.
 config = context.config
 
-# Override sqlalchemy.url with our database URL
-config.set_main_option("sqlalchemy.url", settings.DATABASE_URL)
+# Override sqlalchemy.url with the application's URL, already switched to the asyncpg driver
+# (Railway provides a plain postgresql:// URL)
+config.set_main_option("sqlalchemy.url", database_url)
 
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
@@ -0,0 +1,87 @@
+"""Widen primary/foreign keys and telegram_id to BIGINT, turn SERIAL ids into identity columns
+
+Revision ID: 0001_bigint_ids
+Revises:
+Create Date: 2026-10-16 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001_bigint_ids'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (table, column) pairs widened from INTEGER to BIGINT
+BIGINT_COLUMNS = [
+    ("users", "id"),
+    ("users", "telegram_id"),
+    ("children", "id"),
+    ("children", "user_id"),
+    ("story_series", "id"),
+    ("story_series", "user_id"),
+    ("story_series", "child_id"),
+    ("stories", "id"),
+    ("stories", "user_id"),
+    ("stories", "child_id"),
+    ("stories", "series_id"),
+    ("child_preferences", "id"),
+    ("child_preferences", "child_id"),
+]
+
+
+# Tables whose SERIAL id becomes GENERATED BY DEFAULT AS IDENTITY, as declared in the models
+IDENTITY_TABLES = ["users", "children", "story_series", "stories", "child_preferences"]
+
+
+def _is_identity(table: str) -> bool:
+    return bool(op.get_bind().execute(
+        sa.text(
+            "SELECT is_identity = 'YES' FROM information_schema.columns "
+            "WHERE table_schema = current_schema() AND table_name = :table AND column_name = 'id'"
+        ),
+        {"table": table}
+    ).scalar())
+
+
+def upgrade() -> None:
+    # On a fresh database the tables do not exist yet, create_all builds them with BIGINT already
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+    for table, column in BIGINT_COLUMNS:
+        if table in tables:
+            op.alter_column(table, column, type_=sa.BigInteger(), existing_type=sa.Integer())
+    
+    if bind.dialect.name != "postgresql":
+        return
+    for table in IDENTITY_TABLES:
+        if table not in tables or _is_identity(table):
+            continue
+        # The SERIAL sequence is an integer one and would run out before the BIGINT column does
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id DROP DEFAULT")
+        op.execute(f"DROP SEQUENCE IF EXISTS {table}_id_seq")
+        op.execute(f"ALTER TABLE {table} ALTER COLUMN id ADD GENERATED BY DEFAULT AS IDENTITY")
+        op.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), coalesce(max(id), 0) + 1, false) FROM {table}"
+        )
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    tables = set(sa.inspect(bind).get_table_names())
+    if bind.dialect.name == "postgresql":
+        for table in reversed(IDENTITY_TABLES):
+            if table not in tables or not _is_identity(table):
+                continue
+            op.execute(f"ALTER TABLE {table} ALTER COLUMN id DROP IDENTITY")
+            op.execute(f"CREATE SEQUENCE {table}_id_seq AS integer OWNED BY {table}.id")
+            op.execute(f"ALTER TABLE {table} ALTER COLUMN id SET DEFAULT nextval('{table}_id_seq')")
+            op.execute(f"SELECT setval('{table}_id_seq', coalesce(max(id), 0) + 1, false) FROM {table}")
+    
+    for table, column in reversed(BIGINT_COLUMNS):
+        if table in tables:
+            op.alter_column(table, column, type_=sa.Integer(), existing_type=sa.BigInteger())
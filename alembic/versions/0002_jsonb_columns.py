@@ -0,0 +1,60 @@
+"""Convert JSON columns to JSONB and add GIN indexes
+
+Revision ID: 0002_jsonb_columns
+Revises: 0001_bigint_ids
+Create Date: 2026-10-16 10:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002_jsonb_columns'
+down_revision = '0001_bigint_ids'
+branch_labels = None
+depends_on = None
+
+
+JSONB_COLUMNS = [
+    ("children", "favorite_characters"),
+    ("children", "interests"),
+    ("stories", "characters"),
+    ("story_series", "world_details"),
+    ("story_series", "recurring_characters"),
+    ("child_preferences", "preferred_themes"),
+    ("child_preferences", "avoided_themes"),
+    ("child_preferences", "favorite_music_styles"),
+    ("child_preferences", "preferred_voices"),
+]
+
+GIN_INDEXES = [
+    ("ix_children_interests_gin", "children", "interests"),
+    ("ix_children_favorite_characters_gin", "children", "favorite_characters"),
+    ("ix_story_series_recurring_characters_gin", "story_series", "recurring_characters"),
+]
+
+
+def upgrade() -> None:
+    # Only tables that predate the JSONB models need converting
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for table, column in JSONB_COLUMNS:
+        if table in tables:
+            op.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSONB USING {column}::jsonb"
+            )
+    for name, table, column in GIN_INDEXES:
+        if table in tables:
+            op.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING gin ({column})")
+
+
+def downgrade() -> None:
+    tables = set(sa.inspect(op.get_bind()).get_table_names())
+    for name, table, column in GIN_INDEXES:
+        if table in tables:
+            op.execute(f"DROP INDEX IF EXISTS {name}")
+    for table, column in JSONB_COLUMNS:
+        if table in tables:
+            op.execute(
+                f"ALTER TABLE {table} ALTER COLUMN {column} TYPE JSON USING {column}::json"
+            )
@@ -0,0 +1,31 @@
+"""Add story_series.series_memory
+
+Revision ID: 0003_series_memory
+Revises: 0002_jsonb_columns
+Create Date: 2026-10-16 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import JSONB
+
+
+# revision identifiers, used by Alembic.
+revision = '0003_series_memory'
+down_revision = '0002_jsonb_columns'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # A fresh database gets the column from create_all
+    if sa.inspect(op.get_bind()).has_table("story_series"):
+        op.add_column(
+            "story_series",
+            sa.Column("series_memory", JSONB, nullable=True, server_default=sa.text("'[]'::jsonb")),
+        )
+
+
+def downgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("story_series"):
+        op.drop_column("story_series", "series_memory")
@@ -0,0 +1,45 @@
+"""Add composite indexes for story history and feedback stats
+
+Revision ID: 0004_story_history_indexes
+Revises: 0003_series_memory
+Create Date: 2026-10-16 14:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004_story_history_indexes'
+down_revision = '0003_series_memory'
+branch_labels = None
+depends_on = None
+
+STORY_INDEXES = [
+    ("ix_stories_user_created", ["user_id", sa.text("created_at DESC")]),
+    ("ix_stories_child_created", ["child_id", sa.text("created_at DESC")]),
+    ("ix_stories_user_feedback", ["user_id", "child_feedback"]),
+]
+
+# Leading columns of the composite indexes above
+REDUNDANT_INDEXES = [
+    ("ix_stories_user_id", "user_id"),
+    ("ix_stories_child_id", "child_id"),
+]
+
+
+def upgrade() -> None:
+    # create_all builds the indexes on a fresh database
+    if sa.inspect(op.get_bind()).has_table("stories"):
+        for name, columns in STORY_INDEXES:
+            op.create_index(name, "stories", columns, if_not_exists=True)
+        for name, _ in REDUNDANT_INDEXES:
+            op.drop_index(name, table_name="stories", if_exists=True)
+
+
+def downgrade() -> None:
+    if sa.inspect(op.get_bind()).has_table("stories"):
+        for name, column in REDUNDANT_INDEXES:
+            op.create_index(name, "stories", [column], if_not_exists=True)
+        for name, _ in STORY_INDEXES:
+            op.drop_index(name, table_name="stories", if_exists=True)
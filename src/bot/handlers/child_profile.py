@@ -320,8 +320,9 @@ async def handle_child_selection(
     """Handle child selection from list"""
     child_id = int(callback.data.split("_")[1])
     
+    # The screen shows only profile fields, served from the Redis summary cache
     child_service = ChildService(session)
-    child = await child_service.get_child_by_id(child_id)
+    child = await child_service.get_child_summary(child_id)
     
     if not child:
         await callback.answer("❌ Ребенок не найден", show_alert=True)
@@ -331,9 +332,9 @@ async def handle_child_selection(
     keyboard = get_story_type_keyboard(child_id)
     
     await callback.message.edit_text(
-        f"👶 Выбран: {child.name} ({child.age} лет)\n\n"
-        f"🎭 Персонажи: {', '.join(child.favorite_characters[:3])}\n"
-        f"💫 Интересы: {', '.join(child.interests[:3])}\n\n"
+        f"👶 Выбран: {child['name']} ({child['age']} лет)\n\n"
+        f"🎭 Персонажи: {', '.join((child['favorite_characters'] or [])[:3])}\n"
+        f"💫 Интересы: {', '.join((child['interests'] or [])[:3])}\n\n"
         f"Что будем создавать?",
         reply_markup=keyboard
     )
@@ -348,7 +349,7 @@ async def back_to_children_list(
 ):
     """Go back to children selection"""
     child_service = ChildService(session)
-    children = await child_service.get_user_children(current_user.id)
+    children = await child_service.get_user_children_names(current_user.id)
     
     if not children:
         await callback.message.edit_text(
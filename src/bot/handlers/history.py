@@ -26,7 +26,7 @@ async def history_command(
     
     # Get all user stories (recent first)
     stories = await story_service.get_user_stories(current_user.id, limit=20)
-    children = await child_service.get_user_children(current_user.id)
+    children = await child_service.get_user_children_names(current_user.id)
     
     if not stories:
         await message.answer(
@@ -89,7 +89,7 @@ async def view_all_stories(
             stories_text += "Используйте фильтры для более детального просмотра."
             break
     
-    keyboard = get_history_keyboard(len(await ChildService(session).get_user_children(current_user.id)) > 1)
+    keyboard = get_history_keyboard(len(await ChildService(session).get_user_children_names(current_user.id)) > 1)
     await callback.message.edit_text(stories_text, reply_markup=keyboard)
     await callback.answer()
 
@@ -102,7 +102,7 @@ async def filter_by_child(
 ):
     """Show children filter options"""
     child_service = ChildService(session)
-    children = await child_service.get_user_children(current_user.id)
+    children = await child_service.get_user_children_names(current_user.id)
     
     if len(children) <= 1:
         await callback.answer("У вас только один ребенок", show_alert=True)
@@ -298,10 +298,11 @@ async def create_similar_story(
     )
     
     try:
-        # Create new story with similar theme
+        # Create new story with similar theme (a fresh one, not the cached original)
         new_story = await story_service.create_story(
             child_id=child_id,
-            theme=original_story.theme
+            theme=original_story.theme,
+            use_cache=False
         )
         
         # Format new story for display
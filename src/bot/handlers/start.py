@@ -71,7 +71,7 @@ async def story_handler(
     """Handle /story command"""
     
     child_service = ChildService(session)
-    children = await child_service.get_user_children(current_user.id)
+    children = await child_service.get_user_children_names(current_user.id)
     
     if not children:
         # No children - show add child button
@@ -130,7 +130,7 @@ async def menu_create_story_handler(
 ):
     """Handle create story menu button"""
     child_service = ChildService(session)
-    children = await child_service.get_user_children(current_user.id)
+    children = await child_service.get_user_children_names(current_user.id)
     
     if not children:
         keyboard = get_children_keyboard([])
@@ -1,7 +1,11 @@
 """Story creation handlers"""
 import asyncio
-from aiogram import Router, F
-from aiogram.types import Message, CallbackQuery, BufferedInputFile
+import logging
+import time
+from typing import AsyncGenerator, AsyncIterable
+from aiogram import Bot, Router, F
+from aiogram.exceptions import TelegramAPIError
+from aiogram.types import Message, CallbackQuery, InputFile
 from aiogram.filters import StateFilter
 from aiogram.fsm.context import FSMContext
 from sqlalchemy.ext.asyncio import AsyncSession
@@ -10,12 +14,58 @@ from ..states.story_states import StoryCreationStates
 from ..keyboards.inline import get_theme_keyboard, get_feedback_keyboard
 from ...services.story_service import StoryService
 from ...services.child_service import ChildService
-from ...services.tts_service import TTSService
 from ...services.content_safety_service import content_safety, SafetyLevel
+from ...services.tts_service import TTS_TIMEOUT_SECONDS
 from ...models.user import User
 
+logger = logging.getLogger(__name__)
+
 router = Router()
 
+# Streamed audio is uploaded while it is synthesized, so the request may last as long as the synthesis;
+# aiogram's default of 60 seconds would cut long stories off
+AUDIO_UPLOAD_TIMEOUT = TTS_TIMEOUT_SECONDS + 60
+
+# Streamed story preview: Telegram rate-limits edits, so at most one per interval
+STORY_PREVIEW_INTERVAL = 1.0
+STORY_PREVIEW_MAX_CHARS = 3500
+
+
+def story_preview_updater(progress_message: Message):
+    """Callback for streamed story text that shows it growing in the progress message"""
+    parts = []
+    last_edit = 0.0
+    
+    async def on_text(delta: str) -> None:
+        nonlocal last_edit
+        parts.append(delta)
+        now = time.monotonic()
+        if now - last_edit < STORY_PREVIEW_INTERVAL:
+            return
+        last_edit = now
+        
+        text = "".join(parts)
+        if len(text) > STORY_PREVIEW_MAX_CHARS:
+            text = "…" + text[-STORY_PREVIEW_MAX_CHARS:]
+        try:
+            await progress_message.edit_text(f"🔮 Пишу сказку...\n\n{text}", parse_mode=None)
+        except TelegramAPIError:
+            pass  # Preview is best effort, the full story is sent afterwards
+    
+    return on_text
+
+
+class AudioStreamInputFile(InputFile):
+    """Audio uploaded while it is still being synthesized (the request body is sent chunked)"""
+    
+    def __init__(self, chunks: AsyncIterable[bytes], filename: str):
+        super().__init__(filename=filename)
+        self.chunks = chunks
+    
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        async for chunk in self.chunks:
+            yield chunk
+
 
 @router.callback_query(F.data.startswith("new_story_"))
 async def start_new_story(
@@ -104,34 +154,21 @@ async def handle_theme_selection(
         f"🔮 Придумываю историю... {int(time.time()) % 1000}"
     )
     
+    audio_stream = None
     try:
         # Generate story
         print(f"🏗️ Starting story creation for child_id: {child_id}")
+        # Audio with Charlotte's voice is synthesized sentence by sentence while the story is written
         story_service = StoryService(session)
-        story = await story_service.create_story(
+        story, audio_stream = await story_service.stream_story_with_audio(
             child_id=child_id,
-            theme=theme if theme != "random" else None
+            theme=theme if theme != "random" else None,
+            on_text=story_preview_updater(progress_message),
+            mood="cheerful"
         )
         
         # Update progress
         print(f"📝 Story created successfully: {story.id}")
-        await callback.bot.edit_message_text(
-            chat_id=callback.message.chat.id,
-            message_id=progress_message.message_id,
-            text="🎭 Сказка готова! 🎙️ Создаю аудио..."
-        )
-        print(f"✅ Progress message updated")
-        
-        # Generate audio with Charlotte's voice
-        print(f"🎙️ Starting TTS generation...")
-        tts_service = TTSService()
-        audio_buffer = await tts_service.generate_audio_for_story(
-            story_text=story.story_text,
-            child_name=story.child_name,
-            child_age=story.child_age,
-            mood="cheerful"
-        )
-        print(f"✅ TTS result: {'Success' if audio_buffer else 'Failed'}")
         
         # Send the story
         keyboard = get_feedback_keyboard(story.id, child_id)
@@ -195,22 +232,28 @@ async def handle_theme_selection(
             reply_markup=keyboard
         )
         
-        # Send audio if generated successfully
-        if audio_buffer:
+        # The text is already delivered; audio is sent once synthesis has produced its first chunk,
+        # the upload then runs while the ending is still being voiced
+        if audio_stream and await audio_stream.started():
             print(f"🎧 Sending audio file...")
-            audio_file = BufferedInputFile(
-                audio_buffer.read(),
+            audio_file = AudioStreamInputFile(
+                audio_stream,
                 filename=f"story_{story.id}_{story.child_name}.mp3"
             )
             
-            await callback.bot.send_audio(
-                chat_id=callback.message.chat.id,
-                audio=audio_file,
-                title=f"Сказка для {story.child_name}",
-                performer="Charlotte - Сказочница",
-                caption=f"🎧 Аудиоверсия сказки '{story.theme}' для {story.child_name}"
-            )
-            print(f"✅ Audio sent successfully!")
+            try:
+                await callback.bot.send_audio(
+                    chat_id=callback.message.chat.id,
+                    audio=audio_file,
+                    title=f"Сказка для {story.child_name}",
+                    performer="Charlotte - Сказочница",
+                    caption=f"🎧 Аудиоверсия сказки '{story.theme}' для {story.child_name}",
+                    request_timeout=AUDIO_UPLOAD_TIMEOUT
+                )
+                print(f"✅ Audio sent successfully!")
+            except Exception as e:
+                # The story text is already delivered, only the audio is lost
+                logger.error(f"❌ Audio upload failed for story {story.id}: {e}")
         else:
             print(f"❌ No audio to send")
         
@@ -236,6 +279,10 @@ async def handle_theme_selection(
             text=f"😔 Произошла ошибка при создании сказки:\n{str(e)}\n\n"
                  "Попробуйте еще раз через минуту."
         )
+    finally:
+        # Stops synthesis if the audio was not sent (e.g. sending the text failed)
+        if audio_stream:
+            await audio_stream.aclose()
     
     await callback.answer()
 
@@ -303,7 +350,8 @@ async def handle_custom_theme(
         story_service = StoryService(session)
         story = await story_service.create_story(
             child_id=child_id,
-            custom_theme=custom_theme
+            custom_theme=custom_theme,
+            on_text=story_preview_updater(progress_message)
         )
         
         # Update progress
@@ -415,9 +463,13 @@ async def handle_custom_theme_input(
     
     try:
         # Generate story with custom theme
-        from ...services.openai_service import OpenAIService
-        openai_service = OpenAIService()
-        story_data = await openai_service.generate_story(child, custom_theme=custom_theme)
+        from ...services.openai_service import get_openai_service
+        openai_service = get_openai_service()
+        story_data = await openai_service.generate_story(
+            child,
+            custom_theme=custom_theme,
+            on_text=story_preview_updater(progress_message)
+        )
         
         # Save story
         story_service = StoryService(session)
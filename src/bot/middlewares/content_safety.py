@@ -33,7 +33,7 @@ class ContentSafetyMiddleware(BaseMiddleware):
             if not child_service:
                 return await handler(event, data)
             
-            children = await child_service.get_user_children(user_data.id)
+            children = await child_service.get_user_children_names(user_data.id)
             if not children:
                 return await handler(event, data)
             
@@ -41,7 +41,7 @@ class ContentSafetyMiddleware(BaseMiddleware):
             text = event.text.strip()
             
             for child in children:
-                safety_level, violations = content_safety.validate_input(text, child.age)
+                safety_level, violations = await content_safety.validate_input_async(text, child.age)
                 
                 if safety_level == SafetyLevel.BLOCKED:
                     logger.warning(f"Blocked content from user {user_data.id}: {text[:50]}...")
@@ -98,7 +98,7 @@ class ThemeValidationMiddleware(BaseMiddleware):
                 
                 # Нужно получить ID ребенка из callback или состояния
                 # Для упрощения проверяем для всех детей пользователя
-                children = await child_service.get_user_children(user_data.id)
+                children = await child_service.get_user_children_names(user_data.id)
                 
                 for child in children:
                     safety_level, message = content_safety.validate_theme(theme, child.age)
@@ -12,6 +12,10 @@ class Settings(BaseSettings):
     
     # Database
     DATABASE_URL: str
+    DATABASE_STATEMENT_CACHE_SIZE: int = 1024  # asyncpg prepared statements per connection; set 0 behind pgBouncer in transaction mode
+    DATABASE_POOL_SIZE: int = 20
+    DATABASE_MAX_OVERFLOW: int = 10
+    DATABASE_POOL_RECYCLE: int = 3600  # seconds; recycle before server/proxy idle timeouts drop the connection
     
     # Redis
     REDIS_URL: str
@@ -22,15 +26,23 @@ class Settings(BaseSettings):
     # OpenAI
     OPENAI_API_KEY: str
     OPENAI_MODEL: str = "gpt-4o-mini"  # Model for story generation - better for text output
+    OPENAI_MAX_CONCURRENCY: int = 8  # In-flight chat completions per process
+    OPENAI_RPM: int = 500  # Requests per minute allowed by the account tier
+    OPENAI_TPM: int = 200000  # Tokens per minute allowed by the account tier
     
     # ElevenLabs Text-to-Speech
     ELEVENLABS_API_KEY: str = ""
     ELEVENLABS_VOICE_ID: str = "XB0fDUnXU5powFXDhCwa"  # Charlotte - excellent for children's stories
-    ELEVENLABS_MODEL_ID: str = "eleven_multilingual_v2"  # Supports Russian
+    ELEVENLABS_MODEL_ID: str = "eleven_turbo_v2_5"  # Low-latency model for interactive playback, supports Russian
+    ELEVENLABS_QUALITY_MODEL_ID: str = "eleven_multilingual_v2"  # Higher quality, for audio prepared ahead of time
     ELEVENLABS_STABILITY: float = 0.75  # Voice stability (0.0-1.0)
     ELEVENLABS_SIMILARITY_BOOST: float = 0.85  # Voice similarity (0.0-1.0)
     ELEVENLABS_STYLE: float = 0.2  # Voice style exaggeration (0.0-1.0)
     ELEVENLABS_USE_SPEAKER_BOOST: bool = True  # Enhance speaker clarity
+    ELEVENLABS_MAX_CONCURRENCY: int = 4  # Concurrent requests allowed by the ElevenLabs plan
+    TTS_INITIAL_BUFFER_BYTES: int = 16 * 1024  # Audio held back before streaming starts (~0.5s runway)
+    TTS_CACHE_DIR: str = "cache/tts"  # Synthesized story audio, keyed by full text + voice + model + settings
+    TTS_CACHE_MAX_BYTES: int = 512 * 1024 * 1024  # Least recently used files are removed above this size
     
     # Environment
     ENVIRONMENT: str = "development"
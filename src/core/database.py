@@ -2,6 +2,7 @@
 Database configuration and session management
 """
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession, async_sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
 from sqlalchemy.orm import DeclarativeBase
 from .config import settings
 
@@ -14,10 +15,26 @@ if database_url.startswith("postgresql://"):
 elif database_url.startswith("postgresql+psycopg2://"):
     database_url = database_url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
 
+# Cache prepared statements on both the asyncpg and SQLAlchemy side so repeated
+# repository queries skip the PARSE round-trip once warm
+connect_args = {}
+if database_url.startswith("postgresql+asyncpg://"):
+    connect_args = {
+        "statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": settings.DATABASE_STATEMENT_CACHE_SIZE,
+    }
+
+# Keep warm connections between commits instead of reconnecting per request
 engine = create_async_engine(
     database_url,
     echo=settings.DEBUG,
-    future=True
+    future=True,
+    connect_args=connect_args,
+    poolclass=AsyncAdaptedQueuePool,
+    pool_size=settings.DATABASE_POOL_SIZE,
+    max_overflow=settings.DATABASE_MAX_OVERFLOW,
+    pool_pre_ping=True,
+    pool_recycle=settings.DATABASE_POOL_RECYCLE
 )
 
 # Async session maker
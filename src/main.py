@@ -6,14 +6,22 @@ import asyncio
 import uuid
 import logging
 import os
+import ssl
 import sys
+from typing import Optional, Tuple
+import aiogram
+import certifi
+from aiohttp import ClientSession, TCPConnector
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
 from aiogram.enums import ParseMode
 from aiogram.fsm.storage.redis import RedisStorage
 
 from .core.config import settings
 from .core.redis import get_redis, close_redis
+from .services.openai_service import close_openai_service
+from .services.tts_service import close_tts_service
 from .bot.handlers import setup_routers
 from .bot.middlewares import setup_middlewares
 
@@ -59,20 +67,121 @@ async def init_database():
             raise
 
 
+class KeepAliveAiohttpSession(AiohttpSession):
+    """HTTP session for Telegram API with a persistent keep-alive connection pool.
+
+    Builds its own connector so TLS connections stay alive between bursts and
+    sendMessage/getUpdates reuse the same socket.
+    """
+
+    def __init__(self, limit: int = 100, keepalive_timeout: float = 75, **kwargs):
+        super().__init__(limit=limit, **kwargs)
+        self.limit = limit
+        self.keepalive_timeout = keepalive_timeout
+        self.client_session: Optional[ClientSession] = None
+
+    async def create_session(self) -> ClientSession:
+        if self.client_session is None or self.client_session.closed:
+            connector = TCPConnector(
+                ssl=ssl.create_default_context(cafile=certifi.where()),
+                limit=self.limit,
+                ttl_dns_cache=3600,
+                keepalive_timeout=self.keepalive_timeout,
+                enable_cleanup_closed=True,
+            )
+            self.client_session = ClientSession(
+                connector=connector,
+                headers={"User-Agent": f"aiogram/{aiogram.__version__}"},
+            )
+        return self.client_session
+
+    async def close(self) -> None:
+        if self.client_session is not None and not self.client_session.closed:
+            await self.client_session.close()
+
+
+def create_bot_session() -> AiohttpSession:
+    """HTTP session for Telegram API"""
+    return KeepAliveAiohttpSession(limit=100)
+
+
+POLLER_LOCK_TTL = 120
+POLLER_LOCK_RENEW_INTERVAL = 60
+
+
+async def acquire_poller_lock(redis) -> Optional[Tuple[str, str]]:
+    """Acquire distributed lock to ensure a single poller"""
+    lock_key = f"bot:poller_lock:{settings.TELEGRAM_BOT_TOKEN[:8]}"
+    lock_value = str(uuid.uuid4())
+    got_lock = await redis.set(lock_key, lock_value, ex=POLLER_LOCK_TTL, nx=True)
+    if not got_lock:
+        return None
+    return lock_key, lock_value
+
+
+async def renew_poller_lock(redis, dp: Dispatcher, lock_key: str, lock_value: str):
+    """Background task to renew lock TTL"""
+    try:
+        while True:
+            await asyncio.sleep(POLLER_LOCK_RENEW_INTERVAL)
+            try:
+                current = await redis.get(lock_key)
+                if current == lock_value:
+                    await redis.expire(lock_key, POLLER_LOCK_TTL)
+                else:
+                    logger.warning("🔓 Poller lock lost to another instance. Stopping polling.")
+                    await dp.stop_polling()
+                    break
+            except Exception as e:
+                logger.error(f"❌ Error renewing poller lock: {e}")
+    except asyncio.CancelledError:
+        pass
+
+
+async def release_poller_lock(redis, lock_key: str, lock_value: str):
+    """Release lock if still owned"""
+    try:
+        current = await redis.get(lock_key)
+        if current == lock_value:
+            await redis.delete(lock_key)
+    except Exception as e:
+        logger.error(f"❌ Error releasing poller lock: {e}")
+
+
+async def run_polling(bot: Bot, dp: Dispatcher, redis):
+    """Poll Telegram while holding the poller lock"""
+    lock = await acquire_poller_lock(redis)
+    if lock is None:
+        logger.warning("🔒 Another instance holds poller lock. Exiting without polling.")
+        return
+    lock_key, lock_value = lock
+
+    # Only request update types some router actually handles
+    allowed_updates = dp.resolve_used_update_types()
+    logger.info(f"📬 Allowed updates: {allowed_updates}")
+
+    renew_task = asyncio.create_task(renew_poller_lock(redis, dp, lock_key, lock_value))
+    try:
+        await dp.start_polling(bot, allowed_updates=allowed_updates)
+    finally:
+        renew_task.cancel()
+        await release_poller_lock(redis, lock_key, lock_value)
+
+
 async def main():
     """Main function to start the bot"""
     
-    # Initialize database first (only in Railway)
-    await init_database()
+    # Initialize database (only in Railway) and Redis concurrently - they are independent
+    _, redis = await asyncio.gather(init_database(), get_redis())
     
     # Initialize bot with default properties
     bot = Bot(
         token=settings.TELEGRAM_BOT_TOKEN,
-        default=DefaultBotProperties(parse_mode=ParseMode.HTML)
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+        session=create_bot_session()
     )
     
     # Setup Redis storage for FSM
-    redis = await get_redis()
     storage = RedisStorage(redis=redis)
     
     # Create dispatcher with FSM storage
@@ -93,57 +202,28 @@ async def main():
             logger.warning(f"🤚 Polling disabled. ENVIRONMENT={settings.ENVIRONMENT}, BOT_ROLE={settings.BOT_ROLE}")
             return
 
-        # Acquire distributed lock to ensure a single poller
-        lock_key = f"bot:poller_lock:{settings.TELEGRAM_BOT_TOKEN[:8]}"
-        lock_value = str(uuid.uuid4())
-        got_lock = await redis.set(lock_key, lock_value, ex=120, nx=True)
-        if not got_lock:
-            logger.warning("🔒 Another instance holds poller lock. Exiting without polling.")
-            return
-
-        # Background task to renew lock TTL
-        renew_task = None
-        async def _renew_lock():
-            try:
-                while True:
-                    await asyncio.sleep(60)
-                    try:
-                        current = await redis.get(lock_key)
-                        if current == lock_value:
-                            await redis.expire(lock_key, 120)
-                        else:
-                            logger.warning("🔓 Poller lock lost to another instance. Stopping polling.")
-                            await dp.stop_polling()
-                            break
-                    except Exception as e:
-                        logger.error(f"❌ Error renewing poller lock: {e}")
-            except asyncio.CancelledError:
-                pass
-
-        renew_task = asyncio.create_task(_renew_lock())
-
-        try:
-            # Start polling
-            await dp.start_polling(bot)
-        finally:
-            if renew_task:
-                renew_task.cancel()
-            # Release lock if still owned
-            try:
-                current = await redis.get(lock_key)
-                if current == lock_value:
-                    await redis.delete(lock_key)
-            except Exception as e:
-                logger.error(f"❌ Error releasing poller lock: {e}")
+        await run_polling(bot, dp, redis)
         
     except Exception as e:
         logger.error(f"❌ Error starting bot: {e}")
         raise
     finally:
         await bot.session.close()
+        await close_openai_service()
+        await close_tts_service()
         await close_redis()
         logger.info("🛑 Bot stopped")
 
 
+def install_uvloop():
+    """Use libuv-based event loop when available (Linux/macOS)"""
+    try:
+        import uvloop
+    except ImportError:
+        return
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+
 if __name__ == "__main__":
+    install_uvloop()
     asyncio.run(main())
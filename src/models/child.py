@@ -1,5 +1,6 @@
 """Child model"""
-from sqlalchemy import Column, Integer, String, JSON, Boolean, DateTime, ForeignKey, func
+from sqlalchemy import Column, BigInteger, Identity, Integer, String, Boolean, DateTime, ForeignKey, Index, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 from ..core.database import Base
@@ -8,13 +9,18 @@ from ..core.database import Base
 class Child(Base):
     """Child profile model"""
     __tablename__ = "children"
+    __table_args__ = (
+        # GIN indexes for membership queries ("children who like X")
+        Index("ix_children_interests_gin", "interests", postgresql_using="gin"),
+        Index("ix_children_favorite_characters_gin", "favorite_characters", postgresql_using="gin"),
+    )
     
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    id = Column(BigInteger, Identity(always=False), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
     name = Column(String(100), nullable=False)
     age = Column(Integer, nullable=False)
-    favorite_characters = Column(JSON, default=list)
-    interests = Column(JSON, default=list)
+    favorite_characters = Column(JSONB, default=list)
+    interests = Column(JSONB, default=list)
     preferred_story_length = Column(Integer, default=5)  # minutes (оптимально для детей)
     preferred_voice_id = Column(String(50), default="XB0fDUnXU5powFXDhCwa")  # Charlotte по умолчанию
     is_active = Column(Boolean, default=True)
@@ -23,7 +29,8 @@ class Child(Base):
     
     # Relationships
     user = relationship("User", back_populates="children")
-    stories = relationship("Story", back_populates="child", lazy="selectin")
+    # Never loaded implicitly: callers that need stories ask for selectinload(Child.stories)
+    stories = relationship("Story", back_populates="child", lazy="raise")
     story_series = relationship("StorySeries", back_populates="child", lazy="selectin")
     
     def __repr__(self):
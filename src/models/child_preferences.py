@@ -1,5 +1,6 @@
 """Child preferences model"""
-from sqlalchemy import Column, Integer, JSON, DateTime, ForeignKey, func
+from sqlalchemy import Column, BigInteger, Identity, Integer, DateTime, ForeignKey, func
+from sqlalchemy.dialects.postgresql import JSONB
 
 from ..core.database import Base
 
@@ -8,14 +9,14 @@ class ChildPreferences(Base):
     """Child preferences for ML personalization"""
     __tablename__ = "child_preferences"
     
-    id = Column(Integer, primary_key=True)
-    child_id = Column(Integer, ForeignKey("children.id"), nullable=False, unique=True)
+    id = Column(BigInteger, Identity(always=False), primary_key=True)
+    child_id = Column(BigInteger, ForeignKey("children.id"), nullable=False, unique=True)
     
     # Learned preferences
-    preferred_themes = Column(JSON, default=list)  # темы которые нравятся
-    avoided_themes = Column(JSON, default=list)   # темы которых избегать
-    favorite_music_styles = Column(JSON, default=list)
-    preferred_voices = Column(JSON, default=list)  # предпочтительные голоса
+    preferred_themes = Column(JSONB, default=list)  # темы которые нравятся
+    avoided_themes = Column(JSONB, default=list)   # темы которых избегать
+    favorite_music_styles = Column(JSONB, default=list)
+    preferred_voices = Column(JSONB, default=list)  # предпочтительные голоса
     
     # Behavioral patterns
     attention_span = Column(Integer, default=10)  # minutes, learned from usage
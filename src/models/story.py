@@ -1,5 +1,6 @@
 """Story model"""
-from sqlalchemy import Column, Integer, String, Text, JSON, Boolean, DateTime, ForeignKey, Float, func
+from sqlalchemy import Column, BigInteger, Identity, Integer, String, Text, Boolean, DateTime, ForeignKey, Float, Index, desc, func
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 from ..core.database import Base
@@ -8,17 +9,28 @@ from ..core.database import Base
 class Story(Base):
     """Story model"""
     __tablename__ = "stories"
-    
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    child_id = Column(Integer, ForeignKey("children.id"), nullable=False, index=True)
-    series_id = Column(Integer, ForeignKey("story_series.id"), nullable=True, index=True)
+    __table_args__ = (
+        # History lists: WHERE user_id/child_id = ? ORDER BY created_at DESC LIMIT n without a sort.
+        # They also serve plain user_id/child_id lookups, so those columns have no indexes of their own
+        Index("ix_stories_user_created", "user_id", desc("created_at")),
+        Index("ix_stories_child_created", "child_id", desc("created_at")),
+        # Feedback counters in get_story_stats
+        Index("ix_stories_user_feedback", "user_id", "child_feedback"),
+    )
+    # Server-generated columns (id, created_at, updated_at) come back in INSERT ... RETURNING,
+    # so a new story needs no refresh SELECT
+    __mapper_args__ = {"eager_defaults": True}
+    
+    id = Column(BigInteger, Identity(always=False), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    child_id = Column(BigInteger, ForeignKey("children.id"), nullable=False)
+    series_id = Column(BigInteger, ForeignKey("story_series.id"), nullable=True, index=True)
     child_name = Column(String(100), nullable=False)
     child_age = Column(Integer, nullable=False)
     
     # Story content
     theme = Column(String(200), nullable=True)
-    characters = Column(JSON, default=list)
+    characters = Column(JSONB, default=list)
     story_text = Column(Text, nullable=False)
     moral = Column(String(500), nullable=True)
     
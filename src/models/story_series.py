@@ -1,5 +1,6 @@
 """Story series model"""
-from sqlalchemy import Column, Integer, String, JSON, Boolean, DateTime, ForeignKey, func, Text
+from sqlalchemy import Column, BigInteger, Identity, Integer, String, Boolean, DateTime, ForeignKey, Index, func, Text
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 
 from ..core.database import Base
@@ -8,17 +9,21 @@ from ..core.database import Base
 class StorySeries(Base):
     """Story series model for continuing stories"""
     __tablename__ = "story_series"
+    __table_args__ = (
+        Index("ix_story_series_recurring_characters_gin", "recurring_characters", postgresql_using="gin"),
+    )
     
-    id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
-    child_id = Column(Integer, ForeignKey("children.id"), nullable=False, index=True)
+    id = Column(BigInteger, Identity(always=False), primary_key=True)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
+    child_id = Column(BigInteger, ForeignKey("children.id"), nullable=False, index=True)
     
     series_name = Column(String(200), nullable=False)  # "Приключения Савы"
     description = Column(Text)  # Описание серии
     main_character = Column(String(100), nullable=False)  # имя ребенка
     setting = Column(String(200), nullable=False)  # "Волшебный лес", "Подводное царство"
-    world_details = Column(JSON, default=dict)  # Детали мира серии
-    recurring_characters = Column(JSON, default=list)  # постоянные персонажи серии
+    world_details = Column(JSONB, default=dict)  # Детали мира серии
+    recurring_characters = Column(JSONB, default=list)  # постоянные персонажи серии
+    series_memory = Column(JSONB, default=list)  # факты прошлых эпизодов: subject, action, object, episode
     
     total_episodes = Column(Integer, default=0)
     current_episode = Column(Integer, default=0)
@@ -1,5 +1,5 @@
 """User model"""
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, func
+from sqlalchemy import Column, BigInteger, Identity, Integer, String, Boolean, DateTime, func
 from sqlalchemy.orm import relationship
 
 from ..core.database import Base
@@ -9,8 +9,8 @@ class User(Base):
     """User model for Telegram bot users"""
     __tablename__ = "users"
     
-    id = Column(Integer, primary_key=True)
-    telegram_id = Column(Integer, unique=True, nullable=False, index=True)
+    id = Column(BigInteger, Identity(always=False), primary_key=True)
+    telegram_id = Column(BigInteger, unique=True, nullable=False, index=True)
     username = Column(String(255), nullable=True)
     first_name = Column(String(255), nullable=False)
     language_code = Column(String(10), default="ru")
@@ -12,6 +12,8 @@ ModelType = TypeVar("ModelType", bound=Base)
 class BaseRepository(Generic[ModelType]):
     """Base repository with CRUD operations"""
     
+    __slots__ = ("session", "model")
+    
     def __init__(self, session: AsyncSession, model: Type[ModelType]):
         self.session = session
         self.model = model
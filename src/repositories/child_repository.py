@@ -1,7 +1,9 @@
 """Child repository"""
 from typing import List, Optional
+from sqlalchemy.engine import Row
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select, and_
+from sqlalchemy.orm import selectinload
 
 from .base import BaseRepository
 from ..models import Child
@@ -10,18 +12,30 @@ from ..models import Child
 class ChildRepository(BaseRepository[Child]):
     """Repository for Child model"""
     
+    __slots__ = ()
+    
     def __init__(self, session: AsyncSession):
         super().__init__(session, Child)
     
     async def get_user_children(self, user_id: int) -> List[Child]:
-        """Get all active children for user"""
+        """Get all active children for user (with stories, profile keyboards show their count)"""
         result = await self.session.execute(
             select(Child)
+            .options(selectinload(Child.stories))
             .where(and_(Child.user_id == user_id, Child.is_active == True))
             .order_by(Child.created_at)
         )
         return list(result.scalars().all())
     
+    async def list_names(self, user_id: int) -> List[Row]:
+        """Get (id, name, age) rows of active children for keyboards, without loading ORM objects"""
+        result = await self.session.execute(
+            select(Child.id, Child.name, Child.age)
+            .where(and_(Child.user_id == user_id, Child.is_active.is_(True)))
+            .order_by(Child.created_at)
+        )
+        return list(result.all())
+    
     async def get_children_by_age_range(self, min_age: int, max_age: int) -> List[Child]:
         """Get children by age range"""
         result = await self.session.execute(
@@ -1,16 +1,19 @@
 """User repository"""
-from typing import Optional
+from typing import Optional, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.orm import lazyload
 from aiogram.types import User as TelegramUser
 
 from .base import BaseRepository
-from ..models import User
+from ..models import User, Child
 
 
 class UserRepository(BaseRepository[User]):
     """Repository for User model"""
     
+    __slots__ = ()
+    
     def __init__(self, session: AsyncSession):
         super().__init__(session, User)
     
@@ -21,6 +24,23 @@ class UserRepository(BaseRepository[User]):
         )
         return result.scalar_one_or_none()
     
+    async def get_with_children_count(self, user_id: int) -> Tuple[Optional[User], int]:
+        """Get user and number of children in one query, without loading the collections"""
+        children_count = (
+            select(func.count(Child.id))
+            .where(Child.user_id == User.id)
+            .scalar_subquery()
+        )
+        result = await self.session.execute(
+            select(User, children_count)
+            .options(lazyload("*"))
+            .where(User.id == user_id)
+        )
+        row = result.one_or_none()
+        if row is None:
+            return None, 0
+        return row[0], row[1]
+    
     async def create_from_telegram_user(self, telegram_user: TelegramUser) -> User:
         """Create user from Telegram user object"""
         return await self.create(
@@ -1,11 +1,36 @@
 """Child service"""
+import logging
 from typing import List, Optional
+import orjson
+from redis.exceptions import RedisError
+from sqlalchemy import func, select, true, update
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..core.redis import get_redis
 from ..repositories.child_repository import ChildRepository
 from ..models import Child
 from .content_safety_service import content_safety, SafetyLevel
 
+logger = logging.getLogger(__name__)
+
+_SAFE = SafetyLevel.SAFE
+
+# Child profile summaries are read far more often than they change
+CHILD_CACHE_TTL = 300
+
+
+def _child_cache_key(child_id: int) -> str:
+    return f"child:sum:{child_id}"
+
+
+def _clean_items(items: Optional[List[str]]) -> List[str]:
+    """Strip items and drop empty ones"""
+    return [item.strip() for item in (items or []) if item.strip()]
+
+
+def _quote_items(items: List[str]) -> str:
+    return ", ".join(f"'{item}'" for item in items)
+
 
 class ChildService:
     """Service for child operations"""
@@ -18,6 +43,10 @@ class ChildService:
         """Get all children for user"""
         return await self.child_repo.get_user_children(user_id)
     
+    async def get_user_children_names(self, user_id: int) -> List:
+        """Get lightweight (id, name, age) rows of user's children for menus"""
+        return await self.child_repo.list_names(user_id)
+    
     async def create_child_profile(
         self,
         user_id: int,
@@ -40,31 +69,9 @@ class ChildService:
         if len(name.strip()) > 50:
             raise ValueError("Имя не может быть длиннее 50 символов")
         
-        # Clean and validate characters
-        clean_characters = []
-        if characters:
-            for char in characters:
-                char_clean = char.strip()
-                if char_clean:
-                    # Проверяем безопасность персонажа
-                    safety_level, problematic_chars = content_safety.validate_characters([char_clean], age)
-                    if safety_level == SafetyLevel.SAFE:
-                        clean_characters.append(char_clean)
-                    else:
-                        raise ValueError(f"Персонаж '{char_clean}' содержит неподходящий для детей контент")
-        
-        # Clean and validate interests
-        clean_interests = []
-        if interests:
-            for interest in interests:
-                interest_clean = interest.strip()
-                if interest_clean:
-                    # Проверяем безопасность интереса
-                    safety_level, problematic_interests = content_safety.validate_interests([interest_clean], age)
-                    if safety_level == SafetyLevel.SAFE:
-                        clean_interests.append(interest_clean)
-                    else:
-                        raise ValueError(f"Интерес '{interest_clean}' содержит неподходящий для детей контент")
+        # Clean and validate characters/interests in one safety call each
+        clean_characters = self._validate_characters(characters, age)
+        clean_interests = self._validate_interests(interests, age)
         
         return await self.child_repo.create_child_profile(
             user_id=user_id,
@@ -75,152 +82,176 @@ class ChildService:
             story_length=story_length
         )
     
+    def _validate_characters(self, characters: Optional[List[str]], age: int) -> List[str]:
+        """Clean characters and check them all with a single safety call"""
+        clean_characters = _clean_items(characters)
+        safety_level, problematic_chars = content_safety.validate_characters(clean_characters, age)
+        if safety_level is not _SAFE:
+            if len(problematic_chars) == 1:
+                raise ValueError(f"Персонаж {_quote_items(problematic_chars)} содержит неподходящий для детей контент")
+            raise ValueError(f"Персонажи {_quote_items(problematic_chars)} содержат неподходящий для детей контент")
+        return clean_characters
+    
+    def _validate_interests(self, interests: Optional[List[str]], age: int) -> List[str]:
+        """Clean interests and check them all with a single safety call"""
+        clean_interests = _clean_items(interests)
+        safety_level, problematic_interests = content_safety.validate_interests(clean_interests, age)
+        if safety_level is not _SAFE:
+            if len(problematic_interests) == 1:
+                raise ValueError(f"Интерес {_quote_items(problematic_interests)} содержит неподходящий для детей контент")
+            raise ValueError(f"Интересы {_quote_items(problematic_interests)} содержат неподходящий для детей контент")
+        return clean_interests
+    
     async def get_child_by_id(self, child_id: int) -> Optional[Child]:
         """Get child by ID"""
         return await self.child_repo.get_by_id(child_id)
     
-    async def update_child_interests(self, child_id: int, interests: List[str]) -> Optional[Child]:
-        """Update child interests"""
-        clean_interests = [interest.strip() for interest in interests if interest.strip()]
-        return await self.child_repo.update_preferences(child_id, interests=clean_interests)
-    
-    async def update_child_characters(self, child_id: int, characters: List[str]) -> Optional[Child]:
-        """Update child favorite characters"""
-        clean_characters = [char.strip() for char in characters if char.strip()]
-        return await self.child_repo.update_preferences(child_id, characters=clean_characters)
-    
     async def get_child_summary(self, child_id: int) -> dict:
-        """Get child profile summary"""
-        child = await self.child_repo.get_by_id(child_id)
+        """Get child profile summary (read-through Redis cache)"""
+        key = _child_cache_key(child_id)
+        try:
+            redis = await get_redis()
+            cached = await redis.get(key)
+        except RedisError as e:
+            logger.warning(f"Child cache read failed for {key}: {e}")
+            redis, cached = None, None
+        
+        if cached:
+            return orjson.loads(cached)
+        
+        result = await self.session.execute(
+            select(
+                Child.id,
+                Child.name,
+                Child.age,
+                Child.favorite_characters,
+                Child.interests,
+                Child.preferred_story_length,
+            ).where(Child.id == child_id)
+        )
+        child = result.one_or_none()
         if not child:
             return {}
         
-        return {
+        summary = {
             "child_id": child.id,
             "name": child.name,
             "age": child.age,
             "favorite_characters": child.favorite_characters,
             "interests": child.interests,
-            "preferred_story_length": child.preferred_story_length,
-            "created_at": child.created_at
+            "preferred_story_length": child.preferred_story_length
         }
+        
+        if redis is not None:
+            try:
+                # Plain JSON types only, so a cache hit is a single orjson.loads
+                await redis.setex(key, CHILD_CACHE_TTL, orjson.dumps(summary))
+            except RedisError as e:
+                logger.warning(f"Child cache write failed for {key}: {e}")
+        
+        return summary
+    
+    async def _invalidate_child_cache(self, child_id: int) -> None:
+        """Drop the cached summary after a write"""
+        try:
+            redis = await get_redis()
+            await redis.delete(_child_cache_key(child_id))
+        except RedisError as e:
+            logger.warning(f"Child cache invalidation failed for child {child_id}: {e}")
+    
+    async def _update_child(self, child_id: int, **values) -> bool:
+        """Write fields with a single UPDATE, without loading the child first"""
+        result = await self.session.execute(
+            update(Child).where(Child.id == child_id).values(**values)
+        )
+        await self.session.commit()
+        await self._invalidate_child_cache(child_id)
+        return result.rowcount > 0
+    
+    async def _get_child_age(self, child_id: int) -> Optional[int]:
+        """Fetch only the age column (needed for content validation)"""
+        result = await self.session.execute(select(Child.age).where(Child.id == child_id))
+        return result.scalar_one_or_none()
     
     async def update_child_name(self, child_id: int, new_name: str) -> bool:
         """Update child's name"""
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
-            return False
-        
-        child.name = new_name.strip()
-        await self.session.commit()
-        return True
+        return await self._update_child(child_id, name=new_name.strip())
     
     async def update_child_age(self, child_id: int, new_age: int) -> bool:
         """Update child's age with validation"""
         if not (2 <= new_age <= 8):
             return False
-            
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
-            return False
         
-        child.age = new_age
-        await self.session.commit()
-        return True
+        return await self._update_child(child_id, age=new_age)
     
     async def update_child_characters(self, child_id: int, new_characters: List[str]) -> bool:
         """Update child's favorite characters"""
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
+        age = await self._get_child_age(child_id)
+        if age is None:
             return False
         
         # Clean and validate characters
-        cleaned_characters = []
-        for char in new_characters:
-            char_clean = char.strip()
-            if char_clean:
-                # Проверяем безопасность персонажа
-                safety_level, problematic_chars = content_safety.validate_characters([char_clean], child.age)
-                if safety_level == SafetyLevel.SAFE:
-                    cleaned_characters.append(char_clean)
-                else:
-                    raise ValueError(f"Персонаж '{char_clean}' содержит неподходящий для детей контент")
-        
-        child.favorite_characters = cleaned_characters[:10]  # Max 10 characters
-        await self.session.commit()
-        return True
+        cleaned_characters = self._validate_characters(new_characters, age)
+        
+        return await self._update_child(child_id, favorite_characters=cleaned_characters[:10])  # Max 10 characters
     
     async def update_child_interests(self, child_id: int, new_interests: List[str]) -> bool:
         """Update child's interests"""
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
+        age = await self._get_child_age(child_id)
+        if age is None:
             return False
         
         # Clean and validate interests
-        cleaned_interests = []
-        for interest in new_interests:
-            interest_clean = interest.strip()
-            if interest_clean:
-                # Проверяем безопасность интереса
-                safety_level, problematic_interests = content_safety.validate_interests([interest_clean], child.age)
-                if safety_level == SafetyLevel.SAFE:
-                    cleaned_interests.append(interest_clean)
-                else:
-                    raise ValueError(f"Интерес '{interest_clean}' содержит неподходящий для детей контент")
-        
-        child.interests = cleaned_interests[:10]  # Max 10 interests
-        await self.session.commit()
-        return True
+        cleaned_interests = self._validate_interests(new_interests, age)
+        
+        return await self._update_child(child_id, interests=cleaned_interests[:10])  # Max 10 interests
     
     async def update_child_story_length(self, child_id: int, new_length: int) -> bool:
         """Update child's preferred story length"""
         if not (1 <= new_length <= 10):  # 1-10 minutes (оптимально для детей)
             return False
-            
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
-            return False
         
-        child.preferred_story_length = new_length
-        await self.session.commit()
-        return True
+        return await self._update_child(child_id, preferred_story_length=new_length)
     
     async def deactivate_child(self, child_id: int) -> bool:
         """Deactivate child profile"""
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
-            return False
-        
-        child.is_active = False
-        await self.session.commit()
-        return True
+        return await self._update_child(child_id, is_active=False)
     
     async def get_child_statistics(self, child_id: int) -> Optional[dict]:
         """Get statistics for a child"""
-        child = await self.child_repo.get_by_id(child_id)
-        if not child:
-            return None
-        
-        from sqlalchemy import select, func
         from ..models import Story
         
-        # Count stories for this child
-        story_count_query = select(func.count(Story.id)).where(Story.child_id == child_id)
-        result = await self.session.execute(story_count_query)
-        story_count = result.scalar() or 0
-        
-        # Get favorite themes
-        themes_query = select(Story.theme).where(Story.child_id == child_id)
-        result = await self.session.execute(themes_query)
-        themes = [row[0] for row in result.fetchall() if row[0]]
-        
-        # Count theme frequency
-        theme_counts = {}
-        for theme in themes:
-            theme_counts[theme] = theme_counts.get(theme, 0) + 1
+        # Per-theme story counts aggregated in Postgres; NULL themes still count towards the total
+        theme_counts = (
+            select(Story.theme, func.count().label("story_count"))
+            .where(Story.child_id == child_id)
+            .group_by(Story.theme)
+            .subquery()
+        )
+        result = await self.session.execute(
+            select(
+                Child.id,
+                Child.name,
+                Child.age,
+                Child.favorite_characters,
+                Child.interests,
+                Child.preferred_story_length,
+                Child.created_at,
+                theme_counts.c.theme,
+                theme_counts.c.story_count,
+            )
+            .outerjoin(theme_counts, true())
+            .where(Child.id == child_id)
+            .order_by(theme_counts.c.story_count.desc().nulls_last())
+        )
+        rows = result.all()
+        if not rows:
+            return None
         
+        child = rows[0]
+        story_count = sum(row.story_count or 0 for row in rows)
         # Get top 3 themes
-        top_themes = sorted(theme_counts.items(), key=lambda x: x[1], reverse=True)[:3]
+        top_themes = [(row.theme, row.story_count) for row in rows if row.theme][:3]
         
         return {
             "child_id": child.id,
@@ -1,11 +1,102 @@
 """Content Safety Service - защита от нежелательного контента"""
+import asyncio
 import re
 import logging
+from bisect import bisect_left
+from functools import lru_cache
 from typing import List, Dict, Tuple, Optional
 from enum import Enum
 
+try:
+    import re2  # google-re2: линейное время сопоставления, без бэктрекинга
+except ImportError:
+    re2 = None
+
+try:
+    import ahocorasick  # pyahocorasick: поиск всех корней за один проход
+except ImportError:
+    ahocorasick = None
+
 logger = logging.getLogger(__name__)
 
+# В RE2 \b и \w работают только с ASCII, поэтому для кириллицы они
+# заменяются на юникодные классы символов
+_RE2_WORD_CHAR = r"[\p{L}\p{N}_]"
+_RE2_WORD_START = r"(?:^|[^\p{L}\p{N}_])"
+_RE2_MAX_MEM = 64 << 20
+
+# Размер кэша результатов проверки (повторяющиеся имена, персонажи, интересы)
+_VALIDATION_CACHE_SIZE = 4096
+
+# Тексты длиннее порога проверяются в пуле потоков, чтобы не блокировать event loop
+_ASYNC_VALIDATION_THRESHOLD = 200
+
+# Очистка текста: HTML теги через regex, опасные символы через str.translate
+_HTML_TAG_RE = (re2 or re).compile(r'<[^>]+>')
+_SANITIZE_TRANS = str.maketrans('', '', '<>{}[]\\|`~')
+
+# Список разрешенных персонажей (исключения)
+_ALLOWED_CHARACTERS = frozenset({
+    'дракон', 'дракоша', 'драконы', 'добрый дракон', 'волшебный дракон',
+    'монстр', 'монстрик', 'дружелюбный монстр', 'добрый монстр',
+    'злодей', 'злой', 'плохой', 'злая ведьма', 'злая волшебница'
+})
+
+# Список запрещенных персонажей (строго)
+_FORBIDDEN_CHARACTERS = frozenset({
+    'насильник', 'насильница', 'маньяк', 'маньячка', 'террорист', 'террористка',
+    'убийца', 'убийца', 'преступник', 'преступница', 'садист', 'садистка',
+    'психопат', 'психопатка', 'наркоман', 'наркоманка', 'алкоголик', 'алкоголичка',
+    'дьявол', 'демон', 'сатана', 'душегуб', 'палач',
+    # Добавляем обходные варианты
+    'алкаш', 'алкашка', 'наркоша', 'наркошка', 'саддюга', 'саддюжка',
+    'пьяница', 'пьяничка', 'торчок', 'торчиха', 'доза', 'дозер',
+    'зверь', 'зверюга', 'монстр', 'монстриха', 'чудовище', 'чудовище'
+})
+
+# Безопасные альтернативы для заблокированного контента
+_SAFE_ALTERNATIVES = {
+    # Альтернативы для персонажей
+    'characters': {
+        'warrior': ['рыцарь', 'герой', 'защитник', 'храбрец'],
+        'monster': ['дружелюбное существо', 'волшебное животное', 'добрый дракон'],
+        'witch': ['волшебница', 'фея', 'магический помощник'],
+        'dragon': ['добрый дракон', 'волшебный дракон', 'дракон-защитник'],
+        'rapist': ['принц', 'рыцарь', 'герой', 'защитник'],
+        'maniac': ['волшебник', 'маг', 'колдун', 'мудрец'],
+        'terrorist': ['путешественник', 'исследователь', 'авантюрист'],
+        'killer': ['охотник', 'воин', 'защитник', 'рыцарь'],
+        'sadist': ['волшебник', 'мудрец', 'учитель', 'наставник'],
+        'alcoholic': ['повар', 'кондитер', 'художник', 'музыкант'],
+        'drug_addict': ['исследователь', 'ученый', 'изобретатель', 'творец'],
+    },
+    
+    # Альтернативы для имен
+    'names': {
+        'sadist': ['Александр', 'Максим', 'Дмитрий', 'Артем'],
+        'rapist': ['Андрей', 'Николай', 'Сергей', 'Владимир'],
+        'maniac': ['Антон', 'Роман', 'Игорь', 'Олег'],
+        'killer': ['Алексей', 'Павел', 'Михаил', 'Евгений'],
+        'default': ['Анна', 'Мария', 'Елена', 'Ольга', 'Татьяна'],
+    },
+    
+    # Альтернативы для тем
+    'themes': {
+        'adventure': ['приключение', 'путешествие', 'исследование'],
+        'friendship': ['дружба', 'помощь', 'взаимопомощь'],
+        'magic': ['волшебство', 'чудеса', 'магия добра'],
+    }
+}
+
+# Плоский список (триггер, первые 2 альтернативы) в порядке словаря выше
+_ALTERNATIVE_TRIGGERS = tuple(
+    (key, tuple(values[:2]))
+    for items in _SAFE_ALTERNATIVES.values()
+    for key, values in items.items()
+)
+_MAX_ALTERNATIVES = 3
+
+
 
 class SafetyLevel(Enum):
     """Уровни безопасности"""
@@ -14,6 +105,112 @@ class SafetyLevel(Enum):
     BLOCKED = "blocked"
 
 
+# Члены Enum - синглтоны, поэтому в горячих циклах сравниваем через is
+_SAFE = SafetyLevel.SAFE
+
+
+def _to_re2(pattern: str) -> str:
+    """Перевод паттерна вида \\b(...)\\w*\\b в синтаксис RE2 с поддержкой кириллицы"""
+    return pattern.replace(r"\w*\b", _RE2_WORD_CHAR + "*").replace(r"\b", _RE2_WORD_START)
+
+
+def _compile_union(
+    patterns: Dict[str, List[str]],
+    categories: Optional[List[str]] = None
+) -> Optional[re.Pattern]:
+    """Объединение паттернов в одно выражение с группой на каждую категорию.
+
+    Один проход finditer находит все категории, имя категории берется из
+    match.lastgroup. Текст приводится к нижнему регистру перед проверкой,
+    поэтому флаг IGNORECASE не нужен.
+    """
+    groups = [
+        f"(?P<{category}>{'|'.join(category_patterns)})"
+        for category, category_patterns in patterns.items()
+        if categories is None or category in categories
+    ]
+    if not groups:
+        return None
+    union = "|".join(groups)
+    if re2 is not None:
+        # Юникодные классы раздувают DFA, стандартного лимита памяти не хватает
+        options = re2.Options()
+        options.max_mem = _RE2_MAX_MEM
+        return re2.compile(_to_re2(union), options)
+    return re.compile(union)
+
+
+def _pattern_stems(pattern: str) -> List[str]:
+    """Корни слов из паттерна вида \\b(корень1|корень2)\\w*\\b"""
+    return pattern[len(r"\b("):-len(r")\w*\b")].split("|")
+
+
+def _stem_categories(patterns: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """Корень -> список категорий, в паттернах которых он встречается"""
+    stem_categories: Dict[str, List[str]] = {}
+    for category, category_patterns in patterns.items():
+        for pattern in category_patterns:
+            for stem in _pattern_stems(pattern):
+                categories = stem_categories.setdefault(stem, [])
+                if category not in categories:
+                    categories.append(category)
+    return stem_categories
+
+
+def _build_stem_automaton(stem_categories: Dict[str, List[str]]):
+    """Автомат Ахо-Корасик: корень -> список категорий"""
+    automaton = ahocorasick.Automaton()
+    for stem, categories in stem_categories.items():
+        automaton.add_word(stem, (len(stem), categories))
+    automaton.make_automaton()
+    return automaton
+
+
+def _trie_pattern(words) -> str:
+    """Префиксное дерево слов в виде regex: общие префиксы записываются один раз.
+
+    Необязательные хвосты жадные, поэтому совпадает самый длинный корень.
+    """
+    trie: Dict[str, dict] = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = {}  # конец слова
+    
+    def build(node: Dict[str, dict]) -> str:
+        branches = [re.escape(char) + build(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        if '' not in node:
+            return body
+        return f"(?:{body})?" if len(branches) == 1 else body + '?'
+    
+    return build(trie)
+
+
+def _compile_stem_regex(stems) -> re.Pattern:
+    """Одно выражение \\b(дерево корней) для всех категорий сразу: самый длинный корень с начала слова"""
+    pattern = r"\b(" + _trie_pattern(stems) + r")"
+    if re2 is not None:
+        options = re2.Options()
+        options.max_mem = _RE2_MAX_MEM
+        return re2.compile(_to_re2(pattern), options)
+    return re.compile(pattern)
+
+
+def _is_word_char(char: str) -> bool:
+    return char.isalnum() or char == "_"
+
+
+def _match_categories(union: Optional[re.Pattern], text: str) -> List[str]:
+    """Категории, найденные в тексте (каждая не более одного раза)"""
+    if union is None:
+        return []
+    return list(dict.fromkeys(match.lastgroup for match in union.finditer(text)))
+
+
 class ContentSafetyService:
     """Сервис для проверки безопасности контента"""
     
@@ -21,10 +218,12 @@ class ContentSafetyService:
         self._init_blocked_patterns()
         self._init_warning_patterns()
         self._init_age_inappropriate_content()
+        # Кэш на экземпляре: живет вместе с глобальным content_safety между запросами
+        self._validate_cached = lru_cache(maxsize=_VALIDATION_CACHE_SIZE)(self._validate_bucket)
     
     def _init_blocked_patterns(self):
         """Инициализация заблокированных паттернов"""
-        self.blocked_patterns = {
+        blocked_patterns = {
             # Сексуальный контент
             'sexual': [
                 r'\b(секс|интим|голый|обнаженн|эротик|порно|проститут|изнасилован|изнасилован)\w*\b',
@@ -83,10 +282,19 @@ class ContentSafetyService:
                 r'\b(секта|культ|религиозн конфликт)\w*\b',
             ]
         }
+        self.blocked_patterns = blocked_patterns
+        self._blocked_stems = _stem_categories(blocked_patterns)
+        # Only one matcher is built: the automaton, or the regex when pyahocorasick is missing
+        if ahocorasick:
+            self._blocked_ac = _build_stem_automaton(self._blocked_stems)
+            self._blocked_regex = None
+        else:
+            self._blocked_ac = None
+            self._blocked_regex = _compile_stem_regex(self._blocked_stems)
     
     def _init_warning_patterns(self):
         """Инициализация паттернов для предупреждений"""
-        self.warning_patterns = {
+        warning_patterns = {
             # Слегка проблематичный контент (для старших детей)
             'mild_violence': [
                 r'\b(схватка|борьба|соперничество)\w*\b',
@@ -106,6 +314,7 @@ class ContentSafetyService:
                 r'\b(обман|лгать|ложь|враньё|нечестный)\w*\b',
             ]
         }
+        self.warning_patterns = warning_patterns
     
     def _init_age_inappropriate_content(self):
         """Контент, не подходящий для определенных возрастов"""
@@ -117,6 +326,13 @@ class ContentSafetyService:
             # Для детей 7-8 лет - разрешаем больше, но с осторожностью
             8: ['sexual', 'dangerous_actions', 'controversial', 'substances', 'profanity']
         }
+        # Отсортированные границы возрастных групп для bisect
+        self._age_keys = sorted(self.age_restrictions)
+        # Одно выражение с предупреждениями для каждой возрастной группы
+        self._warning_union_by_age = {
+            age_key: _compile_union(self.warning_patterns, categories)
+            for age_key, categories in self.age_restrictions.items()
+        }
     
     def validate_input(self, text: str, child_age: int) -> Tuple[SafetyLevel, List[str]]:
         """
@@ -132,32 +348,66 @@ class ContentSafetyService:
         if not text or not text.strip():
             return SafetyLevel.SAFE, []
         
-        text_lower = text.lower().strip()
-        violations = []
-        
+        return self._validate_normalized(text.lower().strip(), child_age)
+    
+    async def validate_input_async(self, text: str, child_age: int) -> Tuple[SafetyLevel, List[str]]:
+        """Валидация пользовательского ввода; длинные тексты проверяются вне event loop"""
+        if text and len(text) > _ASYNC_VALIDATION_THRESHOLD:
+            return await asyncio.to_thread(self.validate_input, text, child_age)
+        return self.validate_input(text, child_age)
+    
+    def _validate_normalized(self, text_lower: str, child_age: int) -> Tuple[SafetyLevel, List[str]]:
+        """Валидация текста, уже приведенного к нижнему регистру и без пробелов по краям"""
+        safety_level, violations = self._validate_cached(text_lower, self._age_bucket(child_age))
+        return safety_level, list(violations)
+    
+    def _validate_bucket(self, text_lower: str, age_key: int) -> Tuple[SafetyLevel, Tuple[str, ...]]:
+        """Проверка для возрастной группы; результат неизменяемый, так как кэшируется"""
         # Проверяем заблокированные паттерны
-        for category, patterns in self.blocked_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, text_lower, re.IGNORECASE):
-                    violations.append(f"blocked_{category}")
+        violations = [f"blocked_{category}" for category in self._blocked_categories(text_lower)]
         
         # Проверяем возрастные ограничения
-        age_key = min([age for age in self.age_restrictions.keys() if child_age <= age], default=8)
-        restricted_categories = self.age_restrictions.get(age_key, [])
-        
-        for category, patterns in self.warning_patterns.items():
-            if category in restricted_categories:
-                for pattern in patterns:
-                    if re.search(pattern, text_lower, re.IGNORECASE):
-                        violations.append(f"age_restricted_{category}")
+        violations.extend(
+            f"age_restricted_{category}"
+            for category in _match_categories(self._warning_union_by_age[age_key], text_lower)
+        )
         
         # Определяем уровень безопасности
         if any('blocked_' in v for v in violations):
-            return SafetyLevel.BLOCKED, violations
+            return SafetyLevel.BLOCKED, tuple(violations)
         elif any('age_restricted_' in v for v in violations):
-            return SafetyLevel.WARNING, violations
+            return SafetyLevel.WARNING, tuple(violations)
         else:
-            return SafetyLevel.SAFE, violations
+            return SafetyLevel.SAFE, tuple(violations)
+    
+    def _age_bucket(self, child_age: int) -> int:
+        """Ближайшая возрастная группа не младше ребенка (старшая, если возраст больше всех)"""
+        index = bisect_left(self._age_keys, child_age)
+        return self._age_keys[index] if index < len(self._age_keys) else self._age_keys[-1]
+    
+    def _blocked_categories(self, text_lower: str) -> List[str]:
+        """Заблокированные категории в тексте (автомат Ахо-Корасик или regex по дереву корней)"""
+        found = {}
+        if self._blocked_ac is None:
+            # Поиск с каждого начала слова, а не finditer: совпадения перекрываются
+            # ("заниматься сексом" и "секс"). Захваченная группа - самый длинный корень,
+            # более короткие корни с того же места - его префиксы ("убийц" и "убийца")
+            pos = 0
+            while (match := self._blocked_regex.search(text_lower, pos)) is not None:
+                stem = match.group(1)
+                for end in range(1, len(stem) + 1):
+                    categories = self._blocked_stems.get(stem[:end])
+                    if categories:
+                        found.update(dict.fromkeys(categories))
+                pos = match.start(1) + 1
+            return list(found)
+        
+        for end, (length, categories) in self._blocked_ac.iter(text_lower):
+            start = end - length + 1
+            # Корень должен начинаться с начала слова, как \b в паттерне
+            if start == 0 or not _is_word_char(text_lower[start - 1]):
+                found.update(dict.fromkeys(categories))
+        return list(found)
     
     def validate_theme(self, theme: str, child_age: int) -> Tuple[SafetyLevel, str]:
         """
@@ -192,40 +442,21 @@ class ContentSafetyService:
         """
         problematic_chars = []
         
-        # Список разрешенных персонажей (исключения)
-        allowed_characters = {
-            'дракон', 'дракоша', 'драконы', 'добрый дракон', 'волшебный дракон',
-            'монстр', 'монстрик', 'дружелюбный монстр', 'добрый монстр',
-            'злодей', 'злой', 'плохой', 'злая ведьма', 'злая волшебница'
-        }
-        
-        # Список запрещенных персонажей (строго)
-        forbidden_characters = {
-            'насильник', 'насильница', 'маньяк', 'маньячка', 'террорист', 'террористка',
-            'убийца', 'убийца', 'преступник', 'преступница', 'садист', 'садистка',
-            'психопат', 'психопатка', 'наркоман', 'наркоманка', 'алкоголик', 'алкоголичка',
-            'дьявол', 'демон', 'сатана', 'душегуб', 'палач',
-            # Добавляем обходные варианты
-            'алкаш', 'алкашка', 'наркоша', 'наркошка', 'саддюга', 'саддюжка',
-            'пьяница', 'пьяничка', 'торчок', 'торчиха', 'доза', 'дозер',
-            'зверь', 'зверюга', 'монстр', 'монстриха', 'чудовище', 'чудовище'
-        }
-        
         for character in characters:
             character_lower = character.lower().strip()
             
             # Сначала проверяем запрещенные персонажи (строго)
-            if character_lower in forbidden_characters:
+            if character_lower in _FORBIDDEN_CHARACTERS:
                 problematic_chars.append(character)
                 continue
             
             # Затем проверяем разрешенные персонажи (исключения)
-            if character_lower in allowed_characters:
+            if character_lower in _ALLOWED_CHARACTERS:
                 continue
             
-            # Проверяем через общую валидацию
-            safety_level, _ = self.validate_input(character, child_age)
-            if safety_level != SafetyLevel.SAFE:
+            # Проверяем через общую валидацию (строка уже нормализована)
+            safety_level, _ = self._validate_normalized(character_lower, child_age)
+            if safety_level is not _SAFE:
                 problematic_chars.append(character)
         
         if problematic_chars:
@@ -247,8 +478,8 @@ class ContentSafetyService:
         problematic_interests = []
         
         for interest in interests:
-            safety_level, _ = self.validate_input(interest, child_age)
-            if safety_level != SafetyLevel.SAFE:
+            safety_level, _ = self._validate_normalized(interest.lower().strip(), child_age)
+            if safety_level is not _SAFE:
                 problematic_interests.append(interest)
         
         if problematic_interests:
@@ -269,11 +500,8 @@ class ContentSafetyService:
         if not text:
             return text
         
-        # Удаляем HTML теги
-        text = re.sub(r'<[^>]+>', '', text)
-        
-        # Удаляем потенциально опасные символы
-        text = re.sub(r'[<>{}[\]\\|`~]', '', text)
+        # Удаляем HTML теги и потенциально опасные символы
+        text = _HTML_TAG_RE.sub('', text).translate(_SANITIZE_TRANS)
         
         # Ограничиваем длину
         if len(text) > 1000:
@@ -292,49 +520,17 @@ class ContentSafetyService:
         Returns:
             List[str]: Список безопасных альтернатив
         """
-        alternatives = {
-            # Альтернативы для персонажей
-            'characters': {
-                'warrior': ['рыцарь', 'герой', 'защитник', 'храбрец'],
-                'monster': ['дружелюбное существо', 'волшебное животное', 'добрый дракон'],
-                'witch': ['волшебница', 'фея', 'магический помощник'],
-                'dragon': ['добрый дракон', 'волшебный дракон', 'дракон-защитник'],
-                'rapist': ['принц', 'рыцарь', 'герой', 'защитник'],
-                'maniac': ['волшебник', 'маг', 'колдун', 'мудрец'],
-                'terrorist': ['путешественник', 'исследователь', 'авантюрист'],
-                'killer': ['охотник', 'воин', 'защитник', 'рыцарь'],
-                'sadist': ['волшебник', 'мудрец', 'учитель', 'наставник'],
-                'alcoholic': ['повар', 'кондитер', 'художник', 'музыкант'],
-                'drug_addict': ['исследователь', 'ученый', 'изобретатель', 'творец'],
-            },
-            
-            # Альтернативы для имен
-            'names': {
-                'sadist': ['Александр', 'Максим', 'Дмитрий', 'Артем'],
-                'rapist': ['Андрей', 'Николай', 'Сергей', 'Владимир'],
-                'maniac': ['Антон', 'Роман', 'Игорь', 'Олег'],
-                'killer': ['Алексей', 'Павел', 'Михаил', 'Евгений'],
-                'default': ['Анна', 'Мария', 'Елена', 'Ольга', 'Татьяна'],
-            },
-            
-            # Альтернативы для тем
-            'themes': {
-                'adventure': ['приключение', 'путешествие', 'исследование'],
-                'friendship': ['дружба', 'помощь', 'взаимопомощь'],
-                'magic': ['волшебство', 'чудеса', 'магия добра'],
-            }
-        }
-        
         # Простой поиск альтернатив
         content_lower = blocked_content.lower()
         suggestions = []
         
-        for category, items in alternatives.items():
-            for key, values in items.items():
-                if key in content_lower:
-                    suggestions.extend(values[:2])  # Берем 2 альтернативы
+        for trigger, values in _ALTERNATIVE_TRIGGERS:
+            if trigger in content_lower:
+                suggestions.extend(values)  # Берем 2 альтернативы
+                if len(suggestions) >= _MAX_ALTERNATIVES:
+                    break
         
-        return suggestions[:3]  # Максимум 3 предложения
+        return suggestions[:_MAX_ALTERNATIVES]  # Максимум 3 предложения
 
 
 # Глобальный экземпляр сервиса
@@ -1,99 +1,668 @@
 """OpenAI service for story generation"""
 import asyncio
+import hashlib
+import logging
+import random
+import re
+import textwrap
 import time
-from typing import Optional, List, Dict
-from openai import AsyncOpenAI
+import weakref
+from types import MappingProxyType
+from typing import Awaitable, Callable, Optional, List, Dict, Mapping, Tuple
+import httpx
+import orjson
+from openai import AsyncOpenAI, DefaultAioHttpClient, DefaultAsyncHttpxClient, RateLimitError
+
+try:
+    import tiktoken  # локальный подсчет токенов до запроса к API
+except ImportError:
+    tiktoken = None
+
+from redis.exceptions import RedisError
 
 from ..core.config import settings
+from ..core.redis import get_redis
 from ..models.child import Child
 
+logger = logging.getLogger(__name__)
+
+# Receives streamed story text deltas
+TextCallback = Callable[[str], Awaitable[None]]
+
+
+# Bump when the static prompt prefix changes so stale cache entries are not routed together
+PROMPT_CACHE_VERSION = "v3"
+
+
+def age_bucket(age: int) -> int:
+    """Age group index shared by guidance tables and prompt cache keys: <=3, <=5, <=7, 8+"""
+    return 0 if age <= 3 else 1 if age <= 5 else 2 if age <= 7 else 3
+
+
+# Адаптации по возрастным группам (индекс - age_bucket), неизменяемые общие экземпляры
+_AGE_ADAPTATIONS = (
+    MappingProxyType({
+        'word_count': '150-200',
+        'complexity': 'простые слова, короткие предложения',
+        'structure': 'простая линейная история с повторами',
+        'moral_style': 'очень простая и прямая мораль'
+    }),
+    MappingProxyType({
+        'word_count': '250-350',
+        'complexity': 'доступные слова, средние предложения',
+        'structure': 'ясная структура с завязкой, развитием и концовкой',
+        'moral_style': 'понятная мораль с примерами'
+    }),
+    MappingProxyType({
+        'word_count': '400-550',
+        'complexity': 'разнообразная лексика, развернутые предложения',
+        'structure': 'полная структура с несколькими событиями',
+        'moral_style': 'глубокая мораль с объяснением'
+    }),
+    MappingProxyType({  # 8 лет
+        'word_count': '600-800',
+        'complexity': 'богатая лексика, сложные предложения',
+        'structure': 'развитая структура с подсюжетами',
+        'moral_style': 'многослойная мораль для размышления'
+    }),
+)
+
+_AGE_BASE_GUIDANCE = (
+    "Простой сюжет, короткие предложения, основные цвета и формы, знакомые предметы",
+    "Простая структура, понятные эмоции, дружба и семья, магические элементы",
+    "Более сложный сюжет, проблемы и их решения, храбрость и доброта",
+    "Развернутые приключения, моральные выборы, дружба и ответственность",  # 8 лет
+)
+
+_AGE_GUIDANCE = tuple(
+    f"{base_guidance}. ДЛИНА: {adaptations['word_count']} слов. ЯЗЫК: {adaptations['complexity']}"
+    for base_guidance, adaptations in zip(_AGE_BASE_GUIDANCE, _AGE_ADAPTATIONS)
+)
+
+
+# Системные промпты собираются один раз при импорте: байт-в-байт одинаковы
+# между запросами и процессами, что важно для prompt caching
+STORYTELLER_SYSTEM_PROMPT = textwrap.dedent("""
+    Ты - волшебный рассказчик сказок для детей. Твоя задача создавать:
+
+    ✨ Захватывающие истории где ребенок - главный герой
+    ✨ Добрые сказки с позитивными персонажами
+    ✨ Возрастно-подходящий контент без страшных элементов
+    ✨ Истории с позитивной моралью и важными жизненными уроками
+    ✨ Яркие, образные описания для развития воображения
+
+    СТРОГИЕ ОГРАНИЧЕНИЯ БЕЗОПАСНОСТИ:
+    🚫 ЗАПРЕЩЕНО ВКЛЮЧАТЬ:
+    - Любые упоминания насилия, жестокости, смерти, крови
+    - Сексуальный контент или романтические отношения
+    - Наркотики, алкоголь, курение
+    - Нецензурную лексику или грубость
+    - Страшных монстров, ужасы, кошмары
+    - Оружие, драки, войны, конфликты
+    - Политические или религиозные споры
+    - Опасные действия (прыжки с высоты, отравления и т.д.)
+    - Одиночество, депрессию, негативные эмоции
+    - Обман, ложь, нечестность (кроме поучительных примеров)
+
+    ✅ ОБЯЗАТЕЛЬНО ВКЛЮЧАТЬ:
+    - Только добрых, дружелюбных персонажей
+    - Позитивные сюжеты с решением проблем
+    - Счастливые концовки
+    - Поучительные морали о дружбе, доброте, честности
+    - Взаимопомощь и поддержку
+    - Волшебство и чудеса добра
+    - Приключения без опасности
+
+    ВАЖНО: Ребенок должен быть активным участником, а не наблюдателем!
+    При нарушении ограничений - немедленно остановись и создай безопасную альтернативу.
+    Всегда пиши на русском языке.
+
+    ФОРМАТ ОТВЕТА:
+    Верни только валидный JSON-объект с ключами "story" (текст сказки) и "moral"
+    (мораль сказки одним предложением), именно в этом порядке, без другого текста.
+    """).strip()
+
+_AGE_SYSTEM_PROMPT_TEMPLATE = textwrap.dedent("""
+    ВОЗРАСТНЫЕ ТРЕБОВАНИЯ: {guidance}
+
+    ОБЩИЕ ТРЕБОВАНИЯ:
+    - История должна быть добрая, поучительная и позитивная. За основу можно взять популярные сказки, мультфильмы и истории адаптировав их под возраст ребенка.
+    - Используй яркие, образные описания для воображения
+    - Добавь интерактивные моменты где ребенок может представить себя
+
+    СТРУКТУРА:
+    - Увлекательное начало
+    - Интересное приключение или проблема
+    - Активное участие главного героя в решении
+    - Позитивный финал с моралью
+    """).strip()
+
+_AGE_SYSTEM_PROMPTS = tuple(
+    _AGE_SYSTEM_PROMPT_TEMPLATE.format(guidance=guidance) for guidance in _AGE_GUIDANCE
+)
+
+
+# Мораль на случай, если ответ модели не удалось разобрать как JSON
+_DEFAULT_MORALS = (
+    "Важно быть добрым, смелым и помогать другим",
+    "Дружба — это одно из самых важных сокровищ в жизни",
+    "Даже маленькие поступки доброты делают мир лучше",
+    "Настоящая смелость — не в силе, а в сердце",
+    "Делись с другими, и счастья станет больше",
+)
+
+
+def parse_story_envelope(content: str) -> Tuple[str, str]:
+    """Split the model's {"story", "moral"} JSON answer; plain text gets a default moral"""
+    try:
+        data = orjson.loads(content)
+        story_text = data["story"]
+        moral = data.get("moral")
+    except (orjson.JSONDecodeError, KeyError, TypeError, AttributeError):
+        return content, random.choice(_DEFAULT_MORALS)
+    
+    if not isinstance(story_text, str):
+        return content, random.choice(_DEFAULT_MORALS)
+    if not isinstance(moral, str) or not moral.strip():
+        moral = random.choice(_DEFAULT_MORALS)
+    return story_text, moral.strip()
+
+
+_STORY_FIELD_RE = re.compile(r'"story"\s*:\s*"')
+# Complete JSON string content: stops at the closing quote or an escape that is not fully received yet
+# (a \u surrogate pair is only taken whole)
+_JSON_STRING_CHUNK_RE = re.compile(
+    r'(?:[^"\\]|\\u(?![dD][89abAB])[0-9a-fA-F]{4}|\\u[dD][89abAB][0-9a-fA-F]{2}\\u[0-9a-fA-F]{4}|\\[^u])*'
+)
+
+
+class StoryEnvelopeStream:
+    """Forwards the "story" value of a streamed JSON answer to on_text as plain text"""
+    
+    def __init__(self, on_text: TextCallback):
+        self.on_text = on_text
+        self.raw = ""
+        self.position: Optional[int] = None
+        self.closed = False
+    
+    async def feed(self, delta: str) -> None:
+        if self.closed:
+            return
+        self.raw += delta
+        
+        if self.position is None:
+            match = _STORY_FIELD_RE.search(self.raw)
+            if not match:
+                return
+            self.position = match.end()
+        
+        end = _JSON_STRING_CHUNK_RE.match(self.raw, self.position).end()
+        if end < len(self.raw) and self.raw[end] == '"':
+            self.closed = True
+        if end == self.position:
+            return
+        
+        try:
+            text = orjson.loads(f'"{self.raw[self.position:end]}"')
+        except orjson.JSONDecodeError:
+            self.closed = True  # Not valid JSON after all, the preview just stops
+            return
+        self.position = end
+        await self.on_text(text)
+
+
+OPENAI_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+OPENAI_HTTP_TIMEOUT = httpx.Timeout(60.0)
+
+# Rough prompt + completion size of one story request, charged against the TPM budget
+# when the prompt cannot be counted locally
+ESTIMATED_TOKENS_PER_REQUEST = 1000
+STORY_MAX_OUTPUT_TOKENS = 800
+
+# Model-specific completion parameters, resolved once for the configured model
+if settings.OPENAI_MODEL.startswith('gpt-5'):
+    # GPT-5 uses default temperature=1.0 only
+    MODEL_KWARGS = MappingProxyType({"max_completion_tokens": STORY_MAX_OUTPUT_TOKENS})
+else:
+    MODEL_KWARGS = MappingProxyType({"max_tokens": STORY_MAX_OUTPUT_TOKENS, "temperature": 0.8})
+
+# Context windows by model prefix (most specific first)
+_MODEL_CONTEXT_LIMITS = (
+    ("gpt-5", 400000),
+    ("gpt-4.1", 1047576),
+    ("gpt-4o", 128000),
+    ("gpt-4-turbo", 128000),
+    ("gpt-4", 8192),
+    ("gpt-3.5-turbo", 16385),
+)
+MODEL_CONTEXT_LIMIT = next(
+    (limit for prefix, limit in _MODEL_CONTEXT_LIMITS if settings.OPENAI_MODEL.startswith(prefix)),
+    128000
+)
+# Chat format overhead per message and for priming the reply
+_TOKENS_PER_MESSAGE = 3
+_TOKENS_PER_REPLY = 3
+
+
+def _load_encoding():
+    """Tokenizer for the configured model, None if tiktoken or its encoding file is unavailable"""
+    if tiktoken is None:
+        return None
+    try:
+        try:
+            return tiktoken.encoding_for_model(settings.OPENAI_MODEL)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        # The encoding is downloaded on first use; without it prompts are just not pre-checked
+        logger.warning(f"⚠️ tiktoken encoding unavailable, skipping local token counting: {e}")
+        return None
+
+
+_ENC = _load_encoding()
+
+# System prompts are module constants, count each of them once
+_system_token_counts: Dict[str, int] = {}
+
+
+def count_prompt_tokens(messages: List[Dict[str, str]]) -> Optional[int]:
+    """Prompt size in tokens, None when it cannot be counted locally"""
+    if _ENC is None:
+        return None
+    
+    total = _TOKENS_PER_REPLY
+    for message in messages:
+        content = message["content"]
+        if message["role"] == "system":
+            tokens = _system_token_counts.get(content)
+            if tokens is None:
+                tokens = _system_token_counts[content] = len(_ENC.encode(content))
+        else:
+            tokens = len(_ENC.encode(content))
+        total += tokens + _TOKENS_PER_MESSAGE
+    return total
+
+
+def fits_model_context(messages: List[Dict[str, str]]) -> bool:
+    """Whether prompt plus the completion budget fit the model's context window"""
+    prompt_tokens = count_prompt_tokens(messages)
+    return prompt_tokens is None or prompt_tokens + STORY_MAX_OUTPUT_TOKENS <= MODEL_CONTEXT_LIMIT
+
+
+RATE_LIMIT_MAX_ATTEMPTS = 3
+
+
+class TokenBucketLimiter:
+    """Requests-per-minute and tokens-per-minute budget refilled continuously.
+
+    Waits locally until both buckets have capacity instead of letting
+    the API answer 429 (as in OpenAI's api_request_parallel_processor).
+    """
+    
+    def __init__(self, rpm: int, tpm: int):
+        self.max_requests = float(rpm)
+        self.max_tokens = float(tpm)
+        self.available_requests = self.max_requests
+        self.available_tokens = self.max_tokens
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed = now - self.last_update
+        self.last_update = now
+        self.available_requests = min(self.max_requests, self.available_requests + elapsed * self.max_requests / 60)
+        self.available_tokens = min(self.max_tokens, self.available_tokens + elapsed * self.max_tokens / 60)
+    
+    async def acquire(self, estimated_tokens: int = ESTIMATED_TOKENS_PER_REQUEST) -> None:
+        """Take one request and estimated_tokens from the budget, sleeping until they are available"""
+        estimated_tokens = min(estimated_tokens, self.max_tokens)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.available_requests >= 1 and self.available_tokens >= estimated_tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= estimated_tokens
+                    return
+                wait = max(
+                    (1 - self.available_requests) * 60 / self.max_requests,
+                    (estimated_tokens - self.available_tokens) * 60 / self.max_tokens,
+                )
+                await asyncio.sleep(wait)
+
+
+# Generated stories are reused for identical requests (same child profile, theme and prompt version)
+STORY_CACHE_TTL = 30 * 24 * 3600
+
+
+def story_cache_key(child: Child, theme: str) -> str:
+    """Redis key of a generated story: hash of everything that goes into the prompt"""
+    fingerprint = "|".join((
+        settings.OPENAI_MODEL,
+        child.name,
+        str(child.age),
+        ",".join(sorted(child.interests or [])),
+        ",".join(sorted(child.favorite_characters or [])),
+        theme,
+        str(child.preferred_story_length),
+    ))
+    digest = hashlib.sha256(fingerprint.encode()).hexdigest()
+    return f"story:gen:{PROMPT_CACHE_VERSION}:{digest}"
+
+
+# Throttle shared by story and series generations. asyncio primitives belong to the loop
+# they are used in and Celery tasks each run their own loop, so there is one per event loop
+_throttles: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[asyncio.Semaphore, TokenBucketLimiter]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_throttle() -> Tuple[asyncio.Semaphore, TokenBucketLimiter]:
+    """Concurrency semaphore and token bucket of the running event loop"""
+    loop = asyncio.get_running_loop()
+    throttle = _throttles.get(loop)
+    if throttle is None:
+        throttle = _throttles[loop] = (
+            asyncio.Semaphore(settings.OPENAI_MAX_CONCURRENCY),
+            TokenBucketLimiter(settings.OPENAI_RPM, settings.OPENAI_TPM),
+        )
+    return throttle
+
+
+class OrjsonBodyMixin:
+    """Encode JSON request bodies with orjson instead of the stdlib json module httpx uses"""
+    
+    def build_request(self, method, url, *, content=None, json=None, headers=None, **kwargs):
+        if json is not None and content is None:
+            content = orjson.dumps(json)
+            json = None
+            headers = httpx.Headers(headers)
+            headers.setdefault("Content-Type", "application/json")
+        return super().build_request(method, url, content=content, json=json, headers=headers, **kwargs)
+
+
+class OrjsonAioHttpClient(OrjsonBodyMixin, DefaultAioHttpClient):
+    pass
+
+
+class OrjsonAsyncHttpxClient(OrjsonBodyMixin, DefaultAsyncHttpxClient):
+    pass
+
+
+def create_openai_client() -> AsyncOpenAI:
+    """AsyncOpenAI with a pooled client shared by every request.
+
+    The aiohttp transport (openai[aiohttp]) keeps up with many concurrent
+    generations; the stock httpx pool is used only if the extra is missing.
+    Request bodies are serialized with orjson. The SDK's own retries are off:
+    429s are retried by _throttled, which backs off outside the semaphore.
+    """
+    try:
+        http_client = OrjsonAioHttpClient(limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT)
+    except RuntimeError:
+        http_client = OrjsonAsyncHttpxClient(limits=OPENAI_HTTP_LIMITS, timeout=OPENAI_HTTP_TIMEOUT, http2=True)
+    return AsyncOpenAI(api_key=settings.OPENAI_API_KEY, http_client=http_client, max_retries=0)
+
+
+# How long identical non-streaming story requests wait to be sent together as one n=k call
+STORY_COALESCE_WINDOW = 0.05
+
+
+class StoryRequestCoalescer:
+    """Merges identical chat.completions requests arriving within a short window.
+
+    Requests are queued by their serialized params and drained every `window`
+    seconds: each group goes out as a single call with n=len(group), every
+    caller getting its own choice and an equal share of the reported usage.
+    """
+    
+    def __init__(self, create_completion: Callable[..., Awaitable], window: float = STORY_COALESCE_WINDOW):
+        self._create_completion = create_completion
+        self._window = window
+        self._pending: Dict[bytes, Tuple[Dict, List[asyncio.Future]]] = {}
+        self._drain_task: Optional[asyncio.Task] = None
+    
+    async def submit(self, request_params: Dict) -> Tuple[Optional[str], int]:
+        """Queue a request and wait for (content, tokens used) of its choice"""
+        loop = asyncio.get_running_loop()
+        if self._drain_task is not None and self._drain_task.get_loop() is not loop:
+            # Left over from a finished event loop (e.g. a previous asyncio.run in a worker)
+            self._pending = {}
+            self._drain_task = None
+        
+        key = orjson.dumps(request_params, option=orjson.OPT_SORT_KEYS)
+        future = loop.create_future()
+        self._pending.setdefault(key, (request_params, []))[1].append(future)
+        if self._drain_task is None:
+            self._drain_task = asyncio.create_task(self._drain())
+        return await future
+    
+    async def _drain(self) -> None:
+        await asyncio.sleep(self._window)
+        batch, self._pending = self._pending, {}
+        self._drain_task = None
+        await asyncio.gather(*(self._send(params, futures) for params, futures in batch.values()))
+    
+    async def _send(self, request_params: Dict, futures: List[asyncio.Future]) -> None:
+        if len(futures) > 1:
+            request_params = dict(request_params, n=len(futures))
+        try:
+            response = await self._create_completion(**request_params)
+            if len(response.choices) != len(futures):
+                raise Exception(f"GPT вернул {len(response.choices)} вариантов вместо {len(futures)}")
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        
+        # Usage is reported for the whole call, split it between the choices
+        tokens_used = (response.usage.total_tokens if response.usage else 0) // len(futures)
+        for future, choice in zip(futures, response.choices):
+            if not future.done():
+                future.set_result((choice.message.content, tokens_used))
+
 
 class OpenAIService:
     """Service for OpenAI API interactions"""
     
-    def __init__(self):
-        self.client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY)
+    def __init__(self, client: Optional[AsyncOpenAI] = None):
+        self.client = client or create_openai_client()
+        self._coalescer = StoryRequestCoalescer(self.create_chat_completion)
+    
+    async def create_chat_completion(self, estimated_tokens: Optional[int] = None, **request_params):
+        """chat.completions.create behind the shared concurrency/rate throttle, retrying 429s with jittered backoff"""
+        return await self._throttled(
+            lambda: self.client.chat.completions.create(**request_params),
+            request_params,
+            estimated_tokens
+        )
+    
+    async def stream_chat_completion(self, on_text: TextCallback, **request_params) -> Tuple[str, int]:
+        """Streamed chat completion: on_text receives each text delta, returns (full text, tokens used)"""
+        
+        async def consume() -> Tuple[str, int]:
+            stream = await self.client.chat.completions.create(
+                **request_params,
+                stream=True,
+                stream_options={"include_usage": True}
+            )
+            parts = []
+            tokens_used = 0
+            async for chunk in stream:
+                # Usage arrives in a final chunk without choices
+                if chunk.usage:
+                    tokens_used = chunk.usage.total_tokens
+                if chunk.choices and chunk.choices[0].delta.content:
+                    delta = chunk.choices[0].delta.content
+                    parts.append(delta)
+                    await on_text(delta)
+            return "".join(parts), tokens_used
+        
+        return await self._throttled(consume, request_params)
+    
+    async def _throttled(self, call, request_params: Dict, estimated_tokens: Optional[int] = None):
+        """Run an API call under the shared semaphore and token bucket, retrying 429s"""
+        # Reject prompts the model cannot take before spending a round-trip on them
+        prompt_tokens = count_prompt_tokens(request_params["messages"])
+        if prompt_tokens is not None and prompt_tokens + STORY_MAX_OUTPUT_TOKENS > MODEL_CONTEXT_LIMIT:
+            raise ValueError(f"Запрос слишком длинный для модели: {prompt_tokens} токенов")
+        
+        if estimated_tokens is None:
+            choices = request_params.get("n", 1)
+            if prompt_tokens is None:
+                estimated_tokens = ESTIMATED_TOKENS_PER_REQUEST * choices
+            else:
+                estimated_tokens = prompt_tokens + STORY_MAX_OUTPUT_TOKENS * choices
+        
+        semaphore, rate_limiter = _get_throttle()
+        for attempt in range(RATE_LIMIT_MAX_ATTEMPTS):
+            try:
+                async with semaphore:
+                    await rate_limiter.acquire(estimated_tokens)
+                    return await call()
+            except RateLimitError:
+                if attempt == RATE_LIMIT_MAX_ATTEMPTS - 1:
+                    raise
+                # Backoff outside the semaphore so other requests are not blocked meanwhile
+                await asyncio.sleep(2 ** attempt * random.uniform(0.5, 1.5))
     
     async def generate_story(
         self,
         child: Child,
         theme: Optional[str] = None,
-        custom_theme: Optional[str] = None
+        custom_theme: Optional[str] = None,
+        use_cache: bool = False,
+        on_text: Optional[TextCallback] = None
     ) -> Dict[str, str]:
-        """Generate personalized story for child"""
+        """Generate personalized story for child.
         
-        # Build context about the child
-        context = self._build_child_context(child)
+        use_cache=True returns the story generated earlier for the same child profile and theme,
+        for idempotent callers only (a user picking a theme again expects a new story); on_text streams the text as it is generated
+        (it is not called for a story taken from the cache).
+        """
         
         # Determine the theme
         story_theme = custom_theme or theme or self._suggest_theme_from_interests(child.interests)
         
-        # Build the prompt
-        prompt = self._build_story_prompt(child, context, story_theme)
+        # Start timing
+        start_time = time.time()
+        
+        cache_key = story_cache_key(child, story_theme)
+        if use_cache:
+            cached = await self._get_cached_story(cache_key)
+            if cached:
+                cached["tokens_used"] = 0
+                cached["generation_time"] = round(time.time() - start_time, 2)
+                return cached
         
         try:
-            # Start timing
-            start_time = time.time()
-            
-            # Use Chat Completions API with proper parameters for GPT-5
-            request_params = {
-                "model": settings.OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": self._get_storyteller_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ]
-            }
-            
-            # Use correct parameters based on model
-            if settings.OPENAI_MODEL.startswith('gpt-5'):
-                request_params["max_completion_tokens"] = 800  # Для коротких детских сказок
-                # GPT-5 uses default temperature=1.0 only
+            request_params = self._build_request_params(child, story_theme)
+            if on_text is None:
+                # Identical requests made at the same moment share one n=k call
+                content, tokens_used = await self._coalescer.submit(request_params)
             else:
-                request_params["max_tokens"] = 800  # Оптимально для 10-минутных сказок
-                request_params["temperature"] = 0.8
+                # Story text goes to the caller as it arrives; the envelope is parsed once complete
+                content, tokens_used = await self.stream_chat_completion(
+                    StoryEnvelopeStream(on_text).feed, **request_params
+                )
+            story_text, moral = parse_story_envelope(content or "")
             
-            response = await self.client.chat.completions.create(**request_params)
-            
-            story_text = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens if response.usage else 0
-            
-            # Debug logging for GPT-5
-            print(f"🔍 DEBUG - Model: {settings.OPENAI_MODEL}")
-            print(f"🔍 DEBUG - Raw response content: {story_text[:200]}...")
-            print(f"🔍 DEBUG - Content length: {len(story_text) if story_text else 0}")
-            print(f"🔍 DEBUG - Tokens used: {tokens_used}")
+            # Debug logging for GPT-5 (formatted only when DEBUG is enabled)
+            logger.debug(
+                "Story generated: model=%s tokens=%d length=%d",
+                settings.OPENAI_MODEL, tokens_used, len(story_text or "")
+            )
             
             if not story_text or not story_text.strip():
-                print("❌ WARNING: Empty story text received from GPT!")
-                print(f"❌ Full response: {response}")
+                logger.warning("Empty story text received from GPT, response: %s", content)
                 raise Exception("GPT вернул пустой ответ")
             
-            # Calculate generation time
-            generation_time = time.time() - start_time
-            
-            return {
-                "story_text": story_text,
-                "theme": story_theme,
-                "characters": child.favorite_characters,
-                "moral": self._extract_moral_from_story(story_text),
-                "tokens_used": tokens_used,
-                "generation_time": round(generation_time, 2)
-            }
+            result = self._build_story_result(child, story_theme, story_text, moral, tokens_used, time.time() - start_time)
             
         except Exception as e:
-            # More detailed error handling
-            if "rate_limit" in str(e).lower():
-                raise Exception("⏳ Слишком много запросов. Попробуйте через минуту.")
-            elif "invalid_api_key" in str(e).lower():
-                raise Exception("🔑 Проблема с API ключом. Обратитесь к администратору.")
-            elif "insufficient_quota" in str(e).lower():
-                raise Exception("💰 Превышен лимит API. Попробуйте позже.")
-            elif "timeout" in str(e).lower():
-                raise Exception("⏱️ Превышено время ожидания. Попробуйте еще раз.")
-            elif "connection" in str(e).lower():
-                raise Exception("🌐 Проблемы с подключением к серверу. Попробуйте позже.")
-            else:
-                raise Exception(f"😔 Не удалось создать сказку: {str(e)[:100]}...")
+            raise self._user_facing_error(e)
+        
+        await self._cache_story(cache_key, result)
+        return result
+    
+    async def _get_cached_story(self, cache_key: str) -> Optional[Dict]:
+        """Look up a previously generated story"""
+        try:
+            redis = await get_redis()
+            cached = await redis.get(cache_key)
+        except RedisError as e:
+            logger.warning(f"Story cache read failed for {cache_key}: {e}")
+            return None
+        return orjson.loads(cached) if cached else None
+    
+    async def _cache_story(self, cache_key: str, result: Dict) -> None:
+        """Remember a generated story for identical requests"""
+        try:
+            redis = await get_redis()
+            await redis.setex(cache_key, STORY_CACHE_TTL, orjson.dumps(result))
+        except RedisError as e:
+            logger.warning(f"Story cache write failed for {cache_key}: {e}")
+    
+    def _build_request_params(self, child: Child, story_theme: str) -> Dict:
+        """Build chat.completions.create kwargs for a story"""
+        
+        # Build context about the child
+        context = self._build_child_context(child)
+        
+        # Build the prompt
+        prompt = self._build_story_prompt(child, context, story_theme)
+        
+        # Use Chat Completions API with proper parameters for GPT-5
+        # Static prefix (storyteller rules + age guidance) first so OpenAI prompt caching can reuse it,
+        # child-specific details go last
+        return {
+            "model": settings.OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": self._get_storyteller_system_prompt()},
+                {"role": "system", "content": self._get_age_system_prompt(child.age)},
+                {"role": "user", "content": prompt}
+            ],
+            "extra_body": {"prompt_cache_key": f"storyteller-{PROMPT_CACHE_VERSION}-age{age_bucket(child.age)}"},
+            # Story and moral come back together as {"story": ..., "moral": ...}
+            "response_format": {"type": "json_object"},
+            **MODEL_KWARGS
+        }
+    
+    def _build_story_result(
+        self,
+        child: Child,
+        story_theme: str,
+        story_text: str,
+        moral: str,
+        tokens_used: int,
+        generation_time: float
+    ) -> Dict[str, str]:
+        """Assemble generate_story result"""
+        return {
+            "story_text": story_text,
+            "theme": story_theme,
+            "characters": child.favorite_characters,
+            "moral": moral,
+            "tokens_used": tokens_used,
+            "generation_time": round(generation_time, 2)
+        }
+    
+    def _user_facing_error(self, e: Exception) -> Exception:
+        """Map API errors to messages shown to the user"""
+        # More detailed error handling
+        if "rate_limit" in str(e).lower():
+            return Exception("⏳ Слишком много запросов. Попробуйте через минуту.")
+        elif "invalid_api_key" in str(e).lower():
+            return Exception("🔑 Проблема с API ключом. Обратитесь к администратору.")
+        elif "insufficient_quota" in str(e).lower():
+            return Exception("💰 Превышен лимит API. Попробуйте позже.")
+        elif "timeout" in str(e).lower():
+            return Exception("⏱️ Превышено время ожидания. Попробуйте еще раз.")
+        elif "connection" in str(e).lower():
+            return Exception("🌐 Проблемы с подключением к серверу. Попробуйте позже.")
+        else:
+            return Exception(f"😔 Не удалось создать сказку: {str(e)[:100]}...")
     
     def _build_child_context(self, child: Child) -> str:
         """Build context about the child for personalization"""
@@ -113,9 +682,7 @@ class OpenAIService:
         return context.strip()
     
     def _build_story_prompt(self, child: Child, context: str, theme: str) -> str:
-        """Build the story generation prompt"""
-        
-        age_guidance = self._get_age_appropriate_guidance(child.age)
+        """Build the child-specific part of the prompt (age guidance lives in the cached system prefix)"""
         
         prompt = f"""
         {context}
@@ -127,107 +694,28 @@ class OpenAIService:
         ТРЕБОВАНИЯ:
         1. {child.name} должен быть главным героем и активным участником событий
         2. Включи любимых персонажей ребенка органично в сюжет
-        3. {age_guidance}
-        4. История должна быть добрая, поучительная и позитивная. За основу можно взять популярные сказки, мультфильмы и истории адаптировав их под возраст ребенка.
-        5. Длина: примерно {child.preferred_story_length} минут чтения
-        6. Используй яркие, образные описания для воображения
-        7. Добавь интерактивные моменты где ребенок может представить себя
-        
-        СТРУКТУРА:
-        - Увлекательное начало
-        - Интересное приключение или проблема
-        - Активное участие {child.name} в решении
-        - Позитивный финал с моралью
+        3. Длина: примерно {child.preferred_story_length} минут чтения
         
         Создай захватывающую историю на русском языке:
         """
         
         return prompt.strip()
     
+    def _get_age_system_prompt(self, age: int) -> str:
+        """Age-group part of the static prompt prefix (identical for every child of the same group)"""
+        return _AGE_SYSTEM_PROMPTS[age_bucket(age)]
+    
     def _get_storyteller_system_prompt(self) -> str:
         """System prompt for the storyteller"""
-        return """
-        Ты - волшебный рассказчик сказок для детей. Твоя задача создавать:
-        
-        ✨ Захватывающие истории где ребенок - главный герой
-        ✨ Добрые сказки с позитивными персонажами
-        ✨ Возрастно-подходящий контент без страшных элементов
-        ✨ Истории с позитивной моралью и важными жизненными уроками
-        ✨ Яркие, образные описания для развития воображения
-        
-        СТРОГИЕ ОГРАНИЧЕНИЯ БЕЗОПАСНОСТИ:
-        🚫 ЗАПРЕЩЕНО ВКЛЮЧАТЬ:
-        - Любые упоминания насилия, жестокости, смерти, крови
-        - Сексуальный контент или романтические отношения
-        - Наркотики, алкоголь, курение
-        - Нецензурную лексику или грубость
-        - Страшных монстров, ужасы, кошмары
-        - Оружие, драки, войны, конфликты
-        - Политические или религиозные споры
-        - Опасные действия (прыжки с высоты, отравления и т.д.)
-        - Одиночество, депрессию, негативные эмоции
-        - Обман, ложь, нечестность (кроме поучительных примеров)
-        
-        ✅ ОБЯЗАТЕЛЬНО ВКЛЮЧАТЬ:
-        - Только добрых, дружелюбных персонажей
-        - Позитивные сюжеты с решением проблем
-        - Счастливые концовки
-        - Поучительные морали о дружбе, доброте, честности
-        - Взаимопомощь и поддержку
-        - Волшебство и чудеса добра
-        - Приключения без опасности
-        
-        ВАЖНО: Ребенок должен быть активным участником, а не наблюдателем!
-        При нарушении ограничений - немедленно остановись и создай безопасную альтернативу.
-        Всегда пиши на русском языке.
-        """
+        return STORYTELLER_SYSTEM_PROMPT
     
     def _get_age_appropriate_guidance(self, age: int) -> str:
         """Get age-appropriate story guidance with length adaptation"""
-        age_adaptations = self._get_age_adaptations(age)
-        
-        base_guidance = ""
-        if age <= 3:
-            base_guidance = "Простой сюжет, короткие предложения, основные цвета и формы, знакомые предметы"
-        elif age <= 5:
-            base_guidance = "Простая структура, понятные эмоции, дружба и семья, магические элементы"
-        elif age <= 7:
-            base_guidance = "Более сложный сюжет, проблемы и их решения, храбрость и доброта"
-        else:  # 8 лет
-            base_guidance = "Развернутые приключения, моральные выборы, дружба и ответственность"
-        
-        return f"{base_guidance}. ДЛИНА: {age_adaptations['word_count']} слов. ЯЗЫК: {age_adaptations['complexity']}"
-    
-    def _get_age_adaptations(self, age: int) -> Dict[str, str]:
-        """Get age-appropriate adaptations for story length and complexity"""
-        if age <= 3:
-            return {
-                'word_count': '150-200',
-                'complexity': 'простые слова, короткие предложения',
-                'structure': 'простая линейная история с повторами',
-                'moral_style': 'очень простая и прямая мораль'
-            }
-        elif age <= 5:
-            return {
-                'word_count': '250-350',
-                'complexity': 'доступные слова, средние предложения',
-                'structure': 'ясная структура с завязкой, развитием и концовкой',
-                'moral_style': 'понятная мораль с примерами'
-            }
-        elif age <= 7:
-            return {
-                'word_count': '400-550',
-                'complexity': 'разнообразная лексика, развернутые предложения',
-                'structure': 'полная структура с несколькими событиями',
-                'moral_style': 'глубокая мораль с объяснением'
-            }
-        else:  # 8 лет
-            return {
-                'word_count': '600-800',
-                'complexity': 'богатая лексика, сложные предложения',
-                'structure': 'развитая структура с подсюжетами',
-                'moral_style': 'многослойная мораль для размышления'
-            }
+        return _AGE_GUIDANCE[age_bucket(age)]
+    
+    def _get_age_adaptations(self, age: int) -> Mapping[str, str]:
+        """Get age-appropriate adaptations for story length and complexity (read-only)"""
+        return _AGE_ADAPTATIONS[age_bucket(age)]
     
     def _suggest_theme_from_interests(self, interests: List[str]) -> str:
         """Suggest theme based on child's interests"""
@@ -235,93 +723,32 @@ class OpenAIService:
             return "волшебное приключение"
         
         # Pick random interest as theme
-        import random
         return random.choice(interests)
     
-    def _extract_moral_from_story(self, story_text: str) -> str:
-        """Extract moral from the story (enhanced with 40 diverse morals)"""
-        import random
-        
-        # Расширенная коллекция моралей на основе ключевых слов в тексте
-        morals = {
-            "дружба": "Дружба — это одно из самых важных сокровищ в жизни",
-            "друг": "Настоящий друг всегда рядом, когда трудно",
-            "вместе": "Лучше вместе, чем поодиночке",
-            
-            "доброта": "Даже маленькие поступки доброты делают мир лучше",
-            "добрый": "Добро всегда возвращается",
-            "добро": "Самое ценное богатство — это добрые дела",
-            "помощь": "Тот, кто помогает другим, помогает и себе",
-            "помогать": "Кто заботится о других, тот никогда не останется один",
-            
-            "храбрость": "Настоящая смелость — не в силе, а в сердце",
-            "смелость": "Смелость — это не отсутствие страха, а умение его преодолеть",
-            "смелый": "Маленькие герои тоже совершают большие дела",
-            "страх": "Не стоит бояться просить помощи",
-            
-            "честность": "Честность всегда важнее обмана",
-            "правда": "Доверие строится поступками",
-            "обман": "Честность всегда важнее обмана",
-            
-            "труд": "Труд и терпение помогают достичь мечты",
-            "работа": "Мечты сбываются, если верить и стараться",
-            "лень": "Лень не приводит к успеху",
-            "терпение": "Терпение помогает преодолеть трудности",
-            
-            "дели": "Делись с другими, и счастья станет больше",
-            "щедрость": "Щедрость делает тебя счастливым",
-            "жадность": "Секрет счастья — в умении делиться",
-            
-            "природа": "Уважай природу и заботься о животных",
-            "животные": "Уважай природу и заботься о животных",
-            
-            "особенный": "Каждый особенный по-своему, и это ценно",
-            "красота": "Настоящая красота — внутри человека",
-            "внешность": "Не суди других по внешности",
-            
-            "зависть": "Зависть разрушает дружбу",
-            "злость": "Нельзя быть счастливым, обижая других",
-            
-            "улыбка": "Улыбка и доброе слово могут изменить день",
-            "смех": "Смех и радость делают жизнь ярче",
-            "радость": "Смех и радость делают жизнь ярче",
-            
-            "учение": "Учиться новому — это всегда полезно",
-            "ошибка": "Ошибки помогают становиться умнее",
-            "умный": "Ум важнее силы",
-            
-            "справедливость": "Справедливость важнее выгоды",
-            "вежливость": "Вежливость открывает сердца людей",
-            "уступать": "Иногда нужно уметь уступить",
-            
-            "семья": "Любовь и забота делают семью крепкой",
-            "мудрость": "Важно слушать старших и мудрых",
-            "беречь": "Нужно беречь то, что имеешь"
-        }
-        
-        story_lower = story_text.lower()
-        
-        # Ищем совпадения с ключевыми словами
-        found_morals = []
-        for keyword, moral in morals.items():
-            if keyword in story_lower:
-                found_morals.append(moral)
-        
-        if found_morals:
-            return random.choice(found_morals)
-        
-        # Fallback - случайная мораль из базового набора
-        default_morals = [
-            "Важно быть добрым, смелым и помогать другим",
-            "Дружба — это одно из самых важных сокровищ в жизни", 
-            "Даже маленькие поступки доброты делают мир лучше",
-            "Настоящая смелость — не в силе, а в сердце",
-            "Делись с другими, и счастья станет больше"
-        ]
-        
-        return random.choice(default_morals)
-    
     async def close(self):
         """Close the OpenAI client"""
         if self.client:
             await self.client.close()
+
+
+# Process-wide instance: one connection pool for all story and series generations
+_openai_service: Optional[OpenAIService] = None
+
+
+def get_openai_service() -> OpenAIService:
+    """Get shared OpenAI service"""
+    global _openai_service
+    
+    if _openai_service is None:
+        _openai_service = OpenAIService()
+    
+    return _openai_service
+
+
+async def close_openai_service():
+    """Close shared OpenAI service (on application shutdown)"""
+    global _openai_service
+    
+    if _openai_service:
+        await _openai_service.close()
+        _openai_service = None
@@ -1,20 +1,131 @@
 """Story series service for managing story series"""
-from typing import List, Optional, Dict, Any
+import random
+import re
+from typing import List, Optional, Dict, Any, Tuple
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select, and_, desc
+from sqlalchemy import select, and_, desc, true
+from sqlalchemy.orm import lazyload
 from datetime import datetime
 
 from ..models import StorySeries, Child, User, Story
-from .openai_service import OpenAIService
+from .openai_service import (
+    OpenAIService, TextCallback, get_openai_service, fits_model_context, MODEL_KWARGS, PROMPT_CACHE_VERSION, age_bucket
+)
+from .story_service import StoryService
 from ..core.config import settings
 
 
+SERIES_SYSTEM_PROMPT = """Ты опытный сказочник, специализирующийся на создании продолжающихся серий сказок для детей. 
+
+Твоя задача - создавать эпизоды, которые:
+- Сохраняют единство мира и персонажей
+- Развивают характеры и отношения между персонажами
+- Каждый эпизод является законченной историей
+- Поддерживают интерес к продолжению серии
+- Адаптированы под возраст ребенка
+- Содержат поучительные элементы
+
+Стиль: добрый, увлекательный, с элементами волшебства и приключений."""
+
+# Возрастные указания для серий (индекс - age_bucket)
+_SERIES_AGE_GUIDANCE = (
+    "Простые слова, повторяющиеся элементы, знакомые ситуации",
+    "Понятные эмоции, простые конфликты, дружба и помощь",
+    "Более сложные приключения, решение проблем, храбрость",
+    "Командная работа, преодоление трудностей, ответственность",
+)
+
+# Второе системное сообщение статического префикса для каждой возрастной группы
+_SERIES_AGE_SYSTEM_PROMPTS = tuple(f"Возрастные требования: {guidance}" for guidance in _SERIES_AGE_GUIDANCE)
+
+
+# Явные указания на мораль в тексте эпизода
+_MORAL_HEADERS = ("мораль:", "урок:", "запомни:", "главное:", "важно понимать:", "вывод:")
+_MORAL_HEADERS_RE = re.compile("|".join(map(re.escape, _MORAL_HEADERS)), re.IGNORECASE)
+
+# Запасные морали эпизодов, если извлечь из текста не удалось
+_EPISODE_MORALS = (
+    "Дружба — это одно из самых важных сокровищ в жизни",
+    "Важно быть добрым, смелым и помогать другим",
+    "Даже маленькие поступки доброты делают мир лучше",
+    "Настоящая смелость — не в силе, а в сердце",
+    "Лучше вместе, чем поодиночке",
+    "Честность всегда важнее обмана",
+    "Труд и терпение помогают достичь мечты",
+    "Маленькие герои тоже совершают большие дела",
+    "Настоящий друг всегда рядом, когда трудно",
+    "Каждый особенный по-своему, и это ценно",
+)
+
+# Series memory: short <subject, action, object, episode> facts instead of replaying past episodes
+SERIES_MEMORY_LIMIT = 60
+_MEMORY_FACTS_PER_EPISODE = 8
+_MEMORY_ACTION_WORDS = 8
+_RECAP_LINES = 5
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?…])\s+")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _entity_stem(name: str) -> str:
+    """Crude Russian stem of a name so declined forms match (лиса -> лис, Тимофей -> тимоф)"""
+    word = name.split()[0].casefold()
+    return word[:max(3, len(word) - 2)]
+
+
+def extract_series_memory(story_text: str, entities: List[str], episode: int) -> List[Dict[str, Any]]:
+    """Pick sentences about known characters and keep them as compact facts"""
+    stems = [(name, _entity_stem(name)) for name in entities if name and name.strip()]
+    facts = []
+    for sentence in _SENTENCE_SPLIT_RE.split(story_text):
+        words = _WORD_RE.findall(sentence)
+        folded = [word.casefold() for word in words]
+        found = []
+        for name, stem in stems:
+            position = next((i for i, word in enumerate(folded) if word.startswith(stem)), None)
+            if position is not None:
+                found.append((position, name))
+        if not found:
+            continue
+        
+        found.sort()
+        position, subject = found[0]
+        action = words[position + 1:position + 1 + _MEMORY_ACTION_WORDS]
+        if len(action) < 2:
+            continue
+        facts.append({
+            "subject": subject,
+            "action": " ".join(action),
+            "object": found[1][1] if len(found) > 1 else None,
+            "episode": episode,
+        })
+    
+    # Prefer facts linking two characters, keep story order
+    chosen = sorted(range(len(facts)), key=lambda i: facts[i]["object"] is None)[:_MEMORY_FACTS_PER_EPISODE]
+    return [facts[i] for i in sorted(chosen)]
+
+
+def recall_series_memory(memory: List[Dict[str, Any]], theme: str, limit: int = _RECAP_LINES) -> List[Dict[str, Any]]:
+    """Facts about characters mentioned in the theme first, then the most recent ones"""
+    theme_words = [word.casefold() for word in _WORD_RE.findall(theme)]
+    
+    def mentioned(name: Optional[str]) -> bool:
+        if not name:
+            return False
+        stem = _entity_stem(name)
+        return any(word.startswith(stem) for word in theme_words)
+    
+    newest_first = memory[::-1]
+    relevant = [fact for fact in newest_first if mentioned(fact["subject"]) or mentioned(fact.get("object"))]
+    recent = [fact for fact in newest_first if fact not in relevant]
+    return sorted((relevant + recent)[:limit], key=lambda fact: fact["episode"])
+
+
 class StorySeriesService:
     """Service for managing story series"""
     
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, openai_service: Optional[OpenAIService] = None):
         self.session = session
-        self.openai_service = OpenAIService()
+        self.openai_service = openai_service or get_openai_service()
     
     async def create_series(
         self,
@@ -85,41 +196,71 @@ class StorySeriesService:
         )
         return result.scalar_one_or_none()
     
+    async def _get_series_for_episode(
+        self,
+        series_id: int,
+        episodes_limit: int = 3
+    ) -> Tuple[Optional[StorySeries], Optional[Child], List[Any]]:
+        """Load series, its child and the last episodes' (episode_number, theme, moral) with a single query"""
+        # Only the columns the prompt context reads, not story_text
+        recent_episodes = (
+            select(Story.episode_number, Story.theme, Story.moral)
+            .where(Story.series_id == StorySeries.id)
+            .order_by(Story.episode_number.desc())
+            .limit(episodes_limit)
+            .lateral("recent_episodes")
+        )
+        result = await self.session.execute(
+            select(
+                StorySeries,
+                Child,
+                recent_episodes.c.episode_number,
+                recent_episodes.c.theme,
+                recent_episodes.c.moral,
+            )
+            .outerjoin(Child, Child.id == StorySeries.child_id)
+            .outerjoin(recent_episodes, true())
+            .where(StorySeries.id == series_id)
+            # The child's selectin series collection is not needed here
+            .options(lazyload(Child.story_series))
+            .order_by(recent_episodes.c.episode_number)
+        )
+        rows = result.all()
+        if not rows:
+            return None, None, []
+        
+        series, child = rows[0].StorySeries, rows[0].Child
+        episodes = [row for row in rows if row.episode_number is not None]
+        return series, child, episodes
+    
     async def create_next_episode(
         self,
         series_id: int,
-        custom_prompt: Optional[str] = None
+        custom_prompt: Optional[str] = None,
+        on_text: Optional[TextCallback] = None
     ) -> Story:
-        """Create next episode in series"""
+        """Create next episode in series (on_text receives the text while it is being generated)"""
         
-        # Get series
-        series = await self.get_series_by_id(series_id)
+        # Series, child and recent episodes in one round trip
+        series, child, previous_episodes = await self._get_series_for_episode(series_id)
         if not series:
             raise ValueError("Series not found")
         
-        # Get child
-        child_result = await self.session.execute(
-            select(Child).where(Child.id == series.child_id)
-        )
-        child = child_result.scalar_one_or_none()
         if not child:
             raise ValueError("Child not found")
         
-        # Get previous episodes for context
-        previous_episodes = await self.get_series_episodes(series_id, limit=3)
-        
         # Generate story content
         story_data = await self._generate_series_episode(
             series=series,
             child=child,
             previous_episodes=previous_episodes,
-            custom_prompt=custom_prompt
+            custom_prompt=custom_prompt,
+            on_text=on_text
         )
         
         # Create story
         next_episode_num = series.current_episode + 1
         
-        from .story_service import StoryService
         story_service = StoryService(self.session)
         
         story = await story_service.create_story_for_series(
@@ -133,6 +274,14 @@ class StorySeriesService:
             generation_time=story_data.get("generation_time", 0.0)
         )
         
+        # Remember what happened for the next episodes' context
+        new_facts = extract_series_memory(
+            story_data["story_text"],
+            [series.main_character, *(series.recurring_characters or [])],
+            next_episode_num
+        )
+        series.series_memory = ((series.series_memory or []) + new_facts)[-SERIES_MEMORY_LIMIT:]
+        
         # Update series
         series.current_episode = next_episode_num
         series.total_episodes = max(series.total_episodes, next_episode_num)
@@ -177,51 +326,31 @@ class StorySeriesService:
         series: StorySeries,
         child: Child,
         previous_episodes: List[Story],
-        custom_prompt: Optional[str] = None
+        custom_prompt: Optional[str] = None,
+        on_text: Optional[TextCallback] = None
     ) -> Dict[str, Any]:
         """Generate story content for series episode using OpenAI"""
         
-        # Build context from previous episodes
-        context = self._build_series_context(series, previous_episodes)
-        
         # Determine theme
         if custom_prompt:
             theme = custom_prompt
         else:
             theme = f"Новое приключение в {series.setting}"
         
-        # Build episode prompt
-        prompt = self._build_episode_prompt(
-            series=series,
-            child=child,
-            context=context,
-            theme=theme,
-            episode_number=series.current_episode + 1
-        )
-        
         # Generate with OpenAI
         try:
-            # Use Chat Completions API with proper parameters for GPT-5
-            request_params = {
-                "model": settings.OPENAI_MODEL,
-                "messages": [
-                    {"role": "system", "content": self._get_series_system_prompt()},
-                    {"role": "user", "content": prompt}
-                ]
-            }
+            request_params = self._build_episode_request(series, child, previous_episodes, theme)
+            # Drop the oldest episodes from the context until the prompt fits the model
+            while previous_episodes and not fits_model_context(request_params["messages"]):
+                previous_episodes = previous_episodes[1:]
+                request_params = self._build_episode_request(series, child, previous_episodes, theme)
             
-            # Use correct parameters based on model
-            if settings.OPENAI_MODEL.startswith('gpt-5'):
-                request_params["max_completion_tokens"] = 800  # Для коротких эпизодов
-                # GPT-5 uses default temperature=1.0 only
+            if on_text is None:
+                response = await self.openai_service.create_chat_completion(**request_params)
+                story_text = response.choices[0].message.content
+                tokens_used = response.usage.total_tokens if response.usage else 0
             else:
-                request_params["max_tokens"] = 800  # Ограничиваем эпизоды серий
-                request_params["temperature"] = 0.8
-            
-            response = await self.openai_service.client.chat.completions.create(**request_params)
-            
-            story_text = response.choices[0].message.content
-            tokens_used = response.usage.total_tokens if response.usage else 0
+                story_text, tokens_used = await self.openai_service.stream_chat_completion(on_text, **request_params)
             
             # Extract moral
             moral = self._extract_episode_moral(story_text)
@@ -236,8 +365,42 @@ class StorySeriesService:
         except Exception as e:
             raise Exception(f"Ошибка генерации эпизода серии: {str(e)}")
     
-    def _build_series_context(self, series: StorySeries, previous_episodes: List[Story]) -> str:
-        """Build context from series and previous episodes"""
+    def _build_episode_request(
+        self,
+        series: StorySeries,
+        child: Child,
+        previous_episodes: List[Story],
+        theme: str
+    ) -> Dict[str, Any]:
+        """Build chat.completions.create kwargs for the next episode"""
+        
+        # Build context from previous episodes
+        context = self._build_series_context(series, previous_episodes, theme)
+        
+        # Build episode prompt
+        prompt = self._build_episode_prompt(
+            series=series,
+            child=child,
+            context=context,
+            theme=theme,
+            episode_number=series.current_episode + 1
+        )
+        
+        # Use Chat Completions API with proper parameters for GPT-5
+        # Static prefix (series rules + age guidance) first for OpenAI prompt caching
+        return {
+            "model": settings.OPENAI_MODEL,
+            "messages": [
+                {"role": "system", "content": self._get_series_system_prompt()},
+                {"role": "system", "content": _SERIES_AGE_SYSTEM_PROMPTS[age_bucket(child.age)]},
+                {"role": "user", "content": prompt}
+            ],
+            "extra_body": {"prompt_cache_key": f"series-{PROMPT_CACHE_VERSION}-age{age_bucket(child.age)}"},
+            **MODEL_KWARGS
+        }
+    
+    def _build_series_context(self, series: StorySeries, previous_episodes: List[Story], theme: str = "") -> str:
+        """Build context from series, previous episodes and remembered facts relevant to the theme"""
         context_parts = [
             f"Серия: {series.series_name}",
             f"Мир: {series.setting}",
@@ -252,6 +415,9 @@ class StorySeriesService:
                 if episode.moral:
                     context_parts.append(f"Мораль: {episode.moral}")
         
+        for fact in recall_series_memory(series.series_memory or [], theme):
+            context_parts.append(f"Ранее: {fact['subject']} {fact['action']} (эпизод {fact['episode']}).")
+        
         return "\\n".join(context_parts)
     
     def _build_episode_prompt(
@@ -262,9 +428,7 @@ class StorySeriesService:
         theme: str,
         episode_number: int
     ) -> str:
-        """Build prompt for series episode"""
-        
-        age_guidance = self._get_age_guidance(child.age)
+        """Build prompt for series episode (age guidance lives in the cached system prefix)"""
         
         prompt = f"""Создай эпизод #{episode_number} для продолжающейся серии сказок.
 
@@ -274,12 +438,11 @@ class StorySeriesService:
 Возраст ребенка: {child.age} лет
 
 Требования:
-1. {age_guidance}
-2. Используй постоянных персонажей серии и мир {series.setting}
-3. Сохраняй преемственность с предыдущими эпизодами
-4. История должна быть законченной, но оставлять возможность для продолжения
-5. Включи элементы, связанные с интересами ребенка: {', '.join(child.interests or [])}
-6. Длина сказки: примерно {child.preferred_story_length * 100} слов
+1. Используй постоянных персонажей серии и мир {series.setting}
+2. Сохраняй преемственность с предыдущими эпизодами
+3. История должна быть законченной, но оставлять возможность для продолжения
+4. Включи элементы, связанные с интересами ребенка: {', '.join(child.interests or [])}
+5. Длина сказки: примерно {child.preferred_story_length * 100} слов
 
 Структура:
 - Краткая связь с предыдущими событиями (если есть)
@@ -293,46 +456,23 @@ class StorySeriesService:
     
     def _get_series_system_prompt(self) -> str:
         """Get system prompt for series generation"""
-        return """Ты опытный сказочник, специализирующийся на создании продолжающихся серий сказок для детей. 
-
-Твоя задача - создавать эпизоды, которые:
-- Сохраняют единство мира и персонажей
-- Развивают характеры и отношения между персонажами
-- Каждый эпизод является законченной историей
-- Поддерживают интерес к продолжению серии
-- Адаптированы под возраст ребенка
-- Содержат поучительные элементы
-
-Стиль: добрый, увлекательный, с элементами волшебства и приключений."""
+        return SERIES_SYSTEM_PROMPT
     
     def _get_age_guidance(self, age: int) -> str:
         """Get age-appropriate guidance for series"""
-        if age <= 3:
-            return "Простые слова, повторяющиеся элементы, знакомые ситуации"
-        elif age <= 5:
-            return "Понятные эмоции, простые конфликты, дружба и помощь"
-        elif age <= 7:
-            return "Более сложные приключения, решение проблем, храбрость"
-        else:
-            return "Командная работа, преодоление трудностей, ответственность"
+        return _SERIES_AGE_GUIDANCE[age_bucket(age)]
     
     def _extract_episode_moral(self, story_text: str) -> str:
         """Extract moral from episode (enhanced with diverse morals)"""
-        import random
-        
-        # Сначала ищем явные моральные указания в тексте
-        moral_keywords = ["мораль:", "урок:", "запомни:", "главное:", "важно понимать:", "вывод:"]
-        
-        text_lower = story_text.lower()
-        for keyword in moral_keywords:
-            if keyword in text_lower:
-                start_pos = text_lower.find(keyword)
-                remaining_text = story_text[start_pos + len(keyword):].strip()
-                
-                # Take the sentence containing the moral
-                sentences = remaining_text.split('.')
-                if sentences and sentences[0].strip():
-                    return sentences[0].strip() + '.'
+        # Сначала ищем явные моральные указания в тексте (один проход регулярного выражения)
+        match = _MORAL_HEADERS_RE.search(story_text)
+        if match:
+            remaining_text = story_text[match.end():].strip()
+            
+            # Take the sentence containing the moral
+            sentences = remaining_text.split('.')
+            if sentences and sentences[0].strip():
+                return sentences[0].strip() + '.'
         
         # Fallback: try to extract from last few sentences
         sentences = story_text.split('.')
@@ -342,20 +482,7 @@ class StorySeriesService:
                 return last_sentence + '.'
         
         # Если не можем извлечь - выбираем случайную подходящую мораль
-        episode_morals = [
-            "Дружба — это одно из самых важных сокровищ в жизни",
-            "Важно быть добрым, смелым и помогать другим",
-            "Даже маленькие поступки доброты делают мир лучше",
-            "Настоящая смелость — не в силе, а в сердце",
-            "Лучше вместе, чем поодиночке",
-            "Честность всегда важнее обмана",
-            "Труд и терпение помогают достичь мечты",
-            "Маленькие герои тоже совершают большие дела",
-            "Настоящий друг всегда рядом, когда трудно",
-            "Каждый особенный по-своему, и это ценно"
-        ]
-        
-        return random.choice(episode_morals)
+        return random.choice(_EPISODE_MORALS)
     
     async def close(self):
         """Close the session"""
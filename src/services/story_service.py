@@ -1,19 +1,37 @@
 """Story service for managing story creation and logic"""
-from typing import Optional, List, Dict
+import asyncio
+from typing import Optional, List, Dict, Tuple
+from sqlalchemy import bindparam, select
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from .openai_service import OpenAIService
+from .openai_service import OpenAIService, TextCallback, get_openai_service
+from .tts_service import AudioStream, SentenceBuffer, get_tts_service, sentence_segments
 from .child_service import ChildService
 from ..repositories.base import BaseRepository
 from ..models import Story, Child
 
 
+# History lists are read on every menu open: build the statements once, parameters are bound per call
+_USER_STORIES_STMT = (
+    select(Story)
+    .where(Story.user_id == bindparam("user_id"))
+    .order_by(Story.created_at.desc())
+    .limit(bindparam("limit"))
+)
+_CHILD_STORIES_STMT = (
+    select(Story)
+    .where(Story.child_id == bindparam("child_id"))
+    .order_by(Story.created_at.desc())
+    .limit(bindparam("limit"))
+)
+
+
 class StoryService:
     """Service for story creation and management"""
     
-    def __init__(self, session: AsyncSession):
+    def __init__(self, session: AsyncSession, openai_service: Optional[OpenAIService] = None):
         self.session = session
-        self.openai_service = OpenAIService()
+        self.openai_service = openai_service or get_openai_service()
         self.child_service = ChildService(session)
         self.story_repo = BaseRepository(session, Story)
     
@@ -21,20 +39,102 @@ class StoryService:
         self,
         child_id: int,
         theme: Optional[str] = None,
-        custom_theme: Optional[str] = None
+        custom_theme: Optional[str] = None,
+        use_cache: bool = False,
+        on_text: Optional[TextCallback] = None
     ) -> Story:
-        """Create a new story for child"""
+        """Create a new story for child (on_text to receive the text while it is being generated).
+        
+        Every call writes a new story; use_cache=True may reuse the text generated earlier for the
+        same child profile and theme, so it is only for idempotent callers (retries, prefetch).
+        """
         
         # Get child information
         child = await self.child_service.get_child_by_id(child_id)
         if not child:
             raise ValueError(f"Ребенок с ID {child_id} не найден")
         
+        return await self._generate_and_save(child, theme, custom_theme, use_cache, on_text)
+    
+    async def stream_story_with_audio(
+        self,
+        child_id: int,
+        theme: Optional[str] = None,
+        custom_theme: Optional[str] = None,
+        on_text: Optional[TextCallback] = None,
+        mood: str = "cheerful",
+        use_cache: bool = False
+    ) -> Tuple[Story, Optional[AudioStream]]:
+        """Create a story and its audio, voicing sentences while the rest of the story is still generated.
+        
+        The story is returned as soon as it is saved; the audio keeps being synthesized in the
+        background (None if TTS is unavailable), await started() before sending it.
+        The caller must aclose() the audio stream.
+        """
+        
+        child = await self.child_service.get_child_by_id(child_id)
+        if not child:
+            raise ValueError(f"Ребенок с ID {child_id} не найден")
+        
+        tts_service = get_tts_service()
+        if not tts_service.client:
+            story = await self._generate_and_save(child, theme, custom_theme, use_cache, on_text)
+            return story, None
+        
+        sentence_buffer = SentenceBuffer()
+        sentences: asyncio.Queue = asyncio.Queue()
+        streamed = False
+        
+        async def on_story_text(delta: str) -> None:
+            nonlocal streamed
+            streamed = True
+            for sentence in sentence_buffer.add(delta):
+                sentences.put_nowait(sentence)
+            if on_text is not None:
+                await on_text(delta)
+        
+        audio = AudioStream(
+            tts_service.stream_audio_for_segments(sentence_segments(sentences), child.name, child.age, mood),
+            on_error=lambda e: tts_service.log_story_audio_error(e, child.name)
+        )
+        try:
+            story = await self._generate_and_save(child, theme, custom_theme, use_cache, on_story_text)
+        except BaseException:
+            await audio.aclose()
+            raise
+        
+        if not streamed:
+            # The story came from the cache or its stream could not be parsed: voice the saved text,
+            # reusing the audio if this story was voiced before
+            await audio.aclose()
+            audio = AudioStream(
+                tts_service.stream_audio_for_text(story.story_text, child.name, child.age, mood),
+                on_error=lambda e: tts_service.log_story_audio_error(e, child.name)
+            )
+            return story, audio
+        
+        for sentence in sentence_buffer.flush():
+            sentences.put_nowait(sentence)
+        sentences.put_nowait(None)
+        return story, audio
+    
+    async def _generate_and_save(
+        self,
+        child: Child,
+        theme: Optional[str],
+        custom_theme: Optional[str],
+        use_cache: bool,
+        on_text: Optional[TextCallback]
+    ) -> Story:
+        """Generate story text for child and store it"""
+        
         # Generate story using OpenAI
         story_data = await self.openai_service.generate_story(
             child=child,
             theme=theme,
-            custom_theme=custom_theme
+            custom_theme=custom_theme,
+            use_cache=use_cache,
+            on_text=on_text
         )
         
         # Create story record in database
@@ -55,38 +155,14 @@ class StoryService:
     
     async def get_user_stories(self, user_id: int, limit: int = 10) -> List[Story]:
         """Get recent stories for user"""
-        from sqlalchemy import select, and_
-        
-        result = await self.session.execute(
-            select(Story)
-            .where(Story.user_id == user_id)
-            .order_by(Story.created_at.desc())
-            .limit(limit)
-        )
+        result = await self.session.execute(_USER_STORIES_STMT, {"user_id": user_id, "limit": limit})
         return list(result.scalars().all())
     
     async def get_child_stories(self, child_id: int, limit: int = 10) -> List[Story]:
         """Get recent stories for specific child"""
-        from sqlalchemy import select
-        
-        result = await self.session.execute(
-            select(Story)
-            .where(Story.child_id == child_id)
-            .order_by(Story.created_at.desc())
-            .limit(limit)
-        )
+        result = await self.session.execute(_CHILD_STORIES_STMT, {"child_id": child_id, "limit": limit})
         return list(result.scalars().all())
     
-    async def get_story_by_id(self, story_id: int) -> Story:
-        """Get specific story by ID"""
-        from sqlalchemy import select
-        
-        result = await self.session.execute(
-            select(Story)
-            .where(Story.id == story_id)
-        )
-        return result.scalar_one_or_none()
-    
     async def create_story_for_series(
         self,
         child_id: int,
@@ -99,11 +175,16 @@ class StoryService:
         generation_time: float = 0.0
     ) -> Story:
         """Create story as part of a series"""
-        from sqlalchemy import select
+        from sqlalchemy.orm import joinedload, lazyload
         
-        # Get child
+        # Get child together with its user in one query; the collections of both are not needed here
         child_result = await self.session.execute(
-            select(Child).where(Child.id == child_id)
+            select(Child)
+            .options(
+                joinedload(Child.user).lazyload("*"),
+                lazyload(Child.story_series)
+            )
+            .where(Child.id == child_id)
         )
         child = child_result.scalar_one_or_none()
         if not child:
@@ -126,17 +207,14 @@ class StoryService:
         )
         
         self.session.add(story)
-        await self.session.commit()
-        await self.session.refresh(story)
         
-        # Update user's free story count
-        user_result = await self.session.execute(
-            select(User).where(User.id == child.user_id)
-        )
-        user = user_result.scalar_one_or_none()
+        # Update user's free story count in the same transaction
+        user = child.user
         if user and user.free_stories_used < 3:
             user.free_stories_used += 1
-            await self.session.commit()
+        
+        # id and timestamps are filled from INSERT ... RETURNING (eager_defaults), no refresh needed
+        await self.session.commit()
         
         return story
     
@@ -156,27 +234,17 @@ class StoryService:
     
     async def get_story_stats(self, user_id: int) -> Dict[str, int]:
         """Get story statistics for user"""
-        from sqlalchemy import select, func
-        
-        # Total stories count
-        total_result = await self.session.execute(
-            select(func.count(Story.id)).where(Story.user_id == user_id)
-        )
-        total_stories = total_result.scalar_one()
+        from sqlalchemy import func
         
-        # Stories with feedback
-        feedback_result = await self.session.execute(
-            select(func.count(Story.id))
-            .where(Story.user_id == user_id, Story.child_feedback.isnot(None))
-        )
-        stories_with_feedback = feedback_result.scalar_one()
-        
-        # Loved stories
-        loved_result = await self.session.execute(
-            select(func.count(Story.id))
-            .where(Story.user_id == user_id, Story.child_feedback == "loved")
+        # All three counts in one pass over the user's stories (COUNT(*) FILTER (WHERE ...))
+        result = await self.session.execute(
+            select(
+                func.count(Story.id),
+                func.count(Story.id).filter(Story.child_feedback.isnot(None)),
+                func.count(Story.id).filter(Story.child_feedback == "loved"),
+            ).where(Story.user_id == user_id)
         )
-        loved_stories = loved_result.scalar_one()
+        total_stories, stories_with_feedback, loved_stories = result.one()
         
         return {
             "total_stories": total_stories,
@@ -184,7 +252,3 @@ class StoryService:
             "loved_stories": loved_stories,
             "feedback_rate": round(stories_with_feedback / total_stories * 100) if total_stories > 0 else 0
         }
-    
-    async def close(self):
-        """Close OpenAI service"""
-        await self.openai_service.close()
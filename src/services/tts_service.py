@@ -2,31 +2,227 @@
 ElevenLabs Text-to-Speech service for generating high-quality audio from stories
 """
 import asyncio
+import hashlib
 import logging
-from typing import Optional
-from io import BytesIO
+import os
+import random
+import re
+import time
+import weakref
+from types import MappingProxyType
+from typing import AsyncIterator, Callable, List, Mapping, Optional
+from pathlib import Path
 
-from elevenlabs.client import ElevenLabs
+import httpx
+import orjson
+from elevenlabs.client import AsyncElevenLabs
 from elevenlabs import Voice, VoiceSettings
+from elevenlabs.core import ApiError
 
 from ..core.config import settings
 
 logger = logging.getLogger(__name__)
 
 
+# Keep TLS connections to ElevenLabs alive between stories
+TTS_HTTP_LIMITS = httpx.Limits(max_keepalive_connections=20, max_connections=100, keepalive_expiry=300)
+# Upper bound for one synthesis request; uploads of streamed audio are sized from it
+TTS_TIMEOUT_SECONDS = 240
+TTS_HTTP_TIMEOUT = httpx.Timeout(float(TTS_TIMEOUT_SECONDS))
+
+# ElevenLabs rejects requests above the plan's concurrency with 429, so keep within it
+# (one semaphore per event loop: asyncio primitives cannot be shared between loops)
+_tts_semaphores: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+TTS_RATE_LIMIT_MAX_ATTEMPTS = 3
+# 429s are retried here with backoff outside the semaphore, not by the SDK
+_TTS_REQUEST_OPTIONS = MappingProxyType({"max_retries": 0})
+
+
+def _get_tts_semaphore() -> asyncio.Semaphore:
+    """Concurrency semaphore of the running event loop"""
+    loop = asyncio.get_running_loop()
+    semaphore = _tts_semaphores.get(loop)
+    if semaphore is None:
+        semaphore = _tts_semaphores[loop] = asyncio.Semaphore(settings.ELEVENLABS_MAX_CONCURRENCY)
+    return semaphore
+
+# Audio waiting for the upload to catch up; synthesis pauses when this many chunks are queued
+AUDIO_STREAM_MAX_CHUNKS = 256
+
+# Sentences queued while the story is still being written are synthesized in segments up to this size
+TTS_SEGMENT_MAX_CHARS = 600
+
+# Voice presets per story mood (read-only, shared by every request)
+_EMOTION_SETTINGS: Mapping[str, Mapping[str, float]] = MappingProxyType({
+    "cheerful": MappingProxyType({"stability": 0.7, "similarity_boost": 0.8, "style": 0.3}),
+    "calm": MappingProxyType({"stability": 0.8, "similarity_boost": 0.9, "style": 0.1}),
+    "excited": MappingProxyType({"stability": 0.6, "similarity_boost": 0.7, "style": 0.4}),
+    "mysterious": MappingProxyType({"stability": 0.9, "similarity_boost": 0.85, "style": 0.2}),
+})
+_VOICE_SETTINGS: Mapping[str, VoiceSettings] = MappingProxyType({
+    mood: VoiceSettings(use_speaker_boost=settings.ELEVENLABS_USE_SPEAKER_BOOST, **emotion)
+    for mood, emotion in _EMOTION_SETTINGS.items()
+})
+
+# Конец предложения: знак препинания, закрывающие кавычки/скобки и пробел
+_SENTENCE_END_RE = re.compile(r'[.!?…]+["»)]*\s')
+_ABBREVIATIONS = frozenset({"т.е", "т.д", "т.п", "т.к", "др", "г", "ул", "см", "им", "стр", "рис", "mr", "mrs", "dr", "st"})
+
+
+def _ends_with_abbreviation(text: str) -> bool:
+    """Period after an abbreviation or an initial (А. С. Пушкин) does not end a sentence"""
+    words = text.split()
+    if not words:
+        return False
+    word = words[-1].lstrip('(«"').rstrip(".").casefold()
+    return (len(word) == 1 and word.isalpha()) or word in _ABBREVIATIONS
+
+
+class SentenceBuffer:
+    """Collects streamed text and hands out complete sentences"""
+    
+    MIN_LENGTH = 10
+    
+    def __init__(self):
+        self._text = ""
+    
+    def add(self, token: str) -> List[str]:
+        """Append a piece of text, return sentences completed by it"""
+        self._text += token
+        sentences = []
+        start = 0
+        for match in _SENTENCE_END_RE.finditer(self._text):
+            if match.group().startswith(".") and _ends_with_abbreviation(self._text[start:match.start()]):
+                continue
+            sentence = self._text[start:match.end()].strip()
+            # Too short to voice on its own (e.g. "Ой!"), keep it with the next one
+            if len(sentence) < self.MIN_LENGTH:
+                continue
+            sentences.append(sentence)
+            start = match.end()
+        self._text = self._text[start:]
+        return sentences
+    
+    def flush(self) -> List[str]:
+        """Whatever is left once the text is complete"""
+        rest = self._text.strip()
+        self._text = ""
+        return [rest] if rest else []
+
+
+async def sentence_segments(queue: "asyncio.Queue[Optional[str]]") -> AsyncIterator[str]:
+    """Join sentences waiting in the queue into segments; None in the queue ends the stream"""
+    while True:
+        sentence = await queue.get()
+        if sentence is None:
+            return
+        
+        parts = [sentence]
+        size = len(sentence)
+        finished = False
+        while size < TTS_SEGMENT_MAX_CHARS and not queue.empty():
+            sentence = queue.get_nowait()
+            if sentence is None:
+                finished = True
+                break
+            parts.append(sentence)
+            size += len(sentence) + 1
+        
+        yield " ".join(parts)
+        if finished:
+            return
+
+
+async def buffer_initial_audio(chunks: AsyncIterator[bytes], size: int) -> AsyncIterator[bytes]:
+    """Hold back the first `size` bytes, then pass chunks through.
+
+    Playback that starts on the very first bytes stutters as soon as the network
+    falls behind; a short head start gives it runway.
+    """
+    head = bytearray()
+    async for chunk in chunks:
+        if head is None:
+            yield chunk
+            continue
+        head += chunk
+        if len(head) >= size:
+            yield bytes(head)
+            head = None
+    if head:
+        yield bytes(head)
+
+
+class AudioStream:
+    """Audio synthesized by a background task.
+
+    Iterate to receive the chunks; aclose() stops the synthesis, so the owner
+    must close it even if the audio is never sent. on_error is called with a
+    synthesis failure whether or not anyone is consuming the audio.
+    """
+
+    def __init__(
+        self,
+        chunks: AsyncIterator[bytes],
+        max_chunks: int = AUDIO_STREAM_MAX_CHUNKS,
+        on_error: Optional[Callable[[Exception], None]] = None
+    ):
+        self.error: Optional[Exception] = None
+        self._on_error = on_error
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+        self._first_chunk: Optional[bytes] = None
+        self._started = False
+        self._task = asyncio.create_task(self._pump(chunks))
+
+    async def _pump(self, chunks: AsyncIterator[bytes]) -> None:
+        try:
+            async for chunk in chunks:
+                await self._queue.put(chunk)
+        except Exception as e:
+            self.error = e
+            if self._on_error is not None:
+                self._on_error(e)
+        await self._queue.put(None)
+
+    async def started(self) -> bool:
+        """Wait for the first chunk; False if synthesis ended without audio (see error)"""
+        if not self._started:
+            self._first_chunk = await self._queue.get()
+            self._started = True
+        return self._first_chunk is not None
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        if not await self.started():
+            return
+        yield self._first_chunk
+        while (chunk := await self._queue.get()) is not None:
+            yield chunk
+        if self.error is not None:
+            raise self.error
+
+    async def aclose(self) -> None:
+        """Stop synthesis (no-op once it has finished)"""
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
 class TTSService:
     """Service for converting text to speech using ElevenLabs"""
 
     def __init__(self):
         """Initialize ElevenLabs Text-to-Speech client"""
         self.client = None
+        self._http_client = None
         self._initialize_client()
 
     def _initialize_client(self):
-        """Initialize ElevenLabs client"""
+        """Initialize ElevenLabs client over a pooled HTTP/2 connection"""
         try:
             if settings.ELEVENLABS_API_KEY:
-                self.client = ElevenLabs(api_key=settings.ELEVENLABS_API_KEY)
+                self._http_client = httpx.AsyncClient(limits=TTS_HTTP_LIMITS, timeout=TTS_HTTP_TIMEOUT, http2=True)
+                self.client = AsyncElevenLabs(api_key=settings.ELEVENLABS_API_KEY, httpx_client=self._http_client)
                 logger.info("✅ ElevenLabs TTS client initialized successfully")
             else:
                 logger.warning("⚠️ ELEVENLABS_API_KEY not set. TTS will not be available.")
@@ -35,6 +231,11 @@ class TTSService:
             logger.error(f"❌ Error initializing ElevenLabs TTS client: {e}")
             self.client = None
 
+    async def close(self):
+        """Close the pooled HTTP client"""
+        if self._http_client:
+            await self._http_client.aclose()
+
     def list_voices(self):
         """List available ElevenLabs voices (limited by API permissions)"""
         if not self.client:
@@ -57,115 +258,216 @@ class TTSService:
         
         return default_voices
 
-    async def generate_audio_for_story(
+    async def stream_audio_for_segments(
         self,
-        story_text: str,
+        segments: AsyncIterator[str],
         child_name: str,
         child_age: int,
         mood: str = "cheerful",
-        voice_id: Optional[str] = None
-    ) -> Optional[BytesIO]:
+        voice_id: Optional[str] = None,
+        quality: bool = False
+    ) -> AsyncIterator[bytes]:
         """
-        Generate audio for a story with child-specific personalization
+        Stream story audio for text segments that arrive while the story is still being written
+        (nothing is yielded when TTS is disabled; errors are raised to the caller).
+        The first TTS_INITIAL_BUFFER_BYTES are held back so the upload starts with some runway;
+        quality=True uses the slower, higher-quality model - for audio prepared ahead of time
         """
         if not self.client:
             logger.info("TTS disabled: ElevenLabs client not initialized")
-            return None
-
-        # Choose voice: use provided voice_id or select based on child's age
-        if voice_id is None:
-            voice_id = self._get_child_appropriate_voice(child_age)
+            return
         
-        # Create personalized intro
-        intro_text = f"Привет, {child_name}! Специально для тебя - новая сказка!"
-        full_text = f"{intro_text}\n\n{story_text}"
+        logger.info(f"🎙️ Generating streamed audio for {child_name} (age {child_age}, mood: {mood})")
         
-        try:
-            logger.info(f"🎙️ Generating audio for {child_name} (age {child_age}, mood: {mood})")
-            
-            # Get emotion-based voice settings
-            emotion_settings = self._get_emotion_settings(mood)
-            
-            voice_settings = VoiceSettings(
-                stability=emotion_settings["stability"],
-                similarity_boost=emotion_settings["similarity_boost"],
-                style=emotion_settings["style"],
-                use_speaker_boost=settings.ELEVENLABS_USE_SPEAKER_BOOST
-            )
-            
-            audio_bytes = self.client.text_to_speech.convert(
-                text=full_text,
-                voice_id=voice_id,
-                voice_settings=voice_settings,
-                model_id=settings.ELEVENLABS_MODEL_ID
-            )
-            
-            # Convert generator to bytes
-            audio_data = b"".join(audio_bytes)
-            audio_buffer = BytesIO(audio_data)
-            audio_buffer.seek(0)
-            
-            logger.info(f"✅ Audio generated successfully for {child_name}: {len(audio_data)} bytes")
-            return audio_buffer
-            
-        except Exception as e:
-            error_str = str(e)
-            lower = error_str.lower()
-            if "quota_exceeded" in lower:
-                logger.info(f"TTS skipped: ElevenLabs quota exceeded for {child_name}")
-            elif "401" in lower or "unauthorized" in lower:
-                logger.info("TTS skipped: ElevenLabs unauthorized (401).")
-            else:
-                logger.error(f"❌ Error generating story audio: {e}")
-            return None
+        voice_id = voice_id or self._get_child_appropriate_voice(child_age)
+        model_id = settings.ELEVENLABS_QUALITY_MODEL_ID if quality else settings.ELEVENLABS_MODEL_ID
+        chunks = self._stream_segments(segments, child_name, voice_id, self._get_voice_settings(mood), model_id)
+        async for chunk in buffer_initial_audio(chunks, settings.TTS_INITIAL_BUFFER_BYTES):
+            yield chunk
 
-    async def generate_audio(
+    async def stream_audio_for_text(
         self,
         text: str,
-        voice_id: Optional[str] = None
-    ) -> Optional[BytesIO]:
-        """
-        Generate basic audio from text
-        """
-        if not self.client:
-            logger.info("TTS disabled: ElevenLabs client not initialized")
-            return None
+        child_name: str,
+        child_age: int,
+        mood: str = "cheerful",
+        voice_id: Optional[str] = None,
+        quality: bool = False
+    ) -> AsyncIterator[bytes]:
+        """Story audio for a finished text, served from the cache when the same story was voiced before"""
+        if self.client:
+            voice_id = voice_id or self._get_child_appropriate_voice(child_age)
+            model_id = settings.ELEVENLABS_QUALITY_MODEL_ID if quality else settings.ELEVENLABS_MODEL_ID
+            cache_path = self._cache_path(
+                f"{self._intro(child_name)} {text}", voice_id, self._get_voice_settings(mood), model_id
+            )
+            cached = await asyncio.to_thread(self._read_cached_audio, cache_path)
+            if cached is not None:
+                logger.info(f"💾 TTS cache hit: {cache_path.name}")
+                yield cached
+                return
+        
+        sentence_buffer = SentenceBuffer()
+        sentences: asyncio.Queue = asyncio.Queue()
+        for sentence in sentence_buffer.add(text) + sentence_buffer.flush():
+            sentences.put_nowait(sentence)
+        sentences.put_nowait(None)
+        async for chunk in self.stream_audio_for_segments(
+            sentence_segments(sentences), child_name, child_age, mood, voice_id, quality
+        ):
+            yield chunk
 
-        voice_id = voice_id or settings.ELEVENLABS_VOICE_ID
+    async def _stream_segments(
+        self,
+        segments: AsyncIterator[str],
+        child_name: str,
+        voice_id: str,
+        voice_settings: VoiceSettings,
+        model_id: str
+    ) -> AsyncIterator[bytes]:
+        """Voice segments one after another, the first one with the personal intro.
+        Audio of the whole story is cached once every segment has been voiced"""
+        previous_text = None
+        text = self._intro(child_name)
+        voiced: List[str] = []
+        audio: List[bytes] = []
+        async for segment in segments:
+            text = f"{text}\n\n{segment}" if previous_text is None else segment
+            # previous_text keeps intonation continuous across segment boundaries
+            async for chunk in self._stream(
+                text, voice_id, voice_settings, previous_text=previous_text, model_id=model_id
+            ):
+                audio.append(chunk)
+                yield chunk
+            voiced.append(text)
+            previous_text = text
         
+        if voiced:
+            cache_path = self._cache_path(" ".join(voiced), voice_id, voice_settings, model_id)
+            await asyncio.to_thread(self._write_cached_audio, cache_path, b"".join(audio))
+
+    @staticmethod
+    def _intro(child_name: str) -> str:
+        return f"Привет, {child_name}! Специально для тебя - новая сказка!"
+
+    @staticmethod
+    def log_story_audio_error(e: Exception, child_name: str) -> None:
+        """Quota and auth problems only disable audio; anything else is an error"""
+        error_str = str(e)
+        lower = error_str.lower()
+        if "quota_exceeded" in lower:
+            logger.info(f"TTS skipped: ElevenLabs quota exceeded for {child_name}")
+        elif "401" in lower or "unauthorized" in lower:
+            logger.info("TTS skipped: ElevenLabs unauthorized (401).")
+        else:
+            logger.error(f"❌ Error generating story audio: {e}")
+
+    def _get_voice_settings(self, mood: str) -> VoiceSettings:
+        """Get emotion-based voice settings"""
+        return _VOICE_SETTINGS.get(mood, _VOICE_SETTINGS["cheerful"])
+
+    async def _stream(
+        self,
+        text: str,
+        voice_id: str,
+        voice_settings: VoiceSettings,
+        previous_text: Optional[str] = None,
+        model_id: Optional[str] = None
+    ) -> AsyncIterator[bytes]:
+        """Streaming endpoint: chunks are yielded while the rest is still being synthesized"""
+        model_id = model_id or settings.ELEVENLABS_MODEL_ID
+        context = {"previous_text": previous_text} if previous_text else {}
+        audio: List[bytes] = []
+        for attempt in range(TTS_RATE_LIMIT_MAX_ATTEMPTS):
+            async with _get_tts_semaphore():
+                start_time = time.monotonic()
+                chunks = self.client.text_to_speech.stream(
+                    voice_id=voice_id,
+                    text=text,
+                    voice_settings=voice_settings,
+                    model_id=model_id,
+                    request_options=dict(_TTS_REQUEST_OPTIONS),
+                    **context
+                )
+                try:
+                    async for chunk in chunks:
+                        if not audio:
+                            logger.info(f"🎧 TTS first audio chunk after {time.monotonic() - start_time:.2f}s")
+                        audio.append(chunk)
+                        yield chunk
+                    break
+                except ApiError as e:
+                    # Only a request that has not produced audio yet can be repeated
+                    if e.status_code != 429 or audio or attempt == TTS_RATE_LIMIT_MAX_ATTEMPTS - 1:
+                        raise
+            # Backoff outside the semaphore so other requests are not blocked meanwhile
+            await asyncio.sleep(2 ** attempt * random.uniform(0.5, 1.5))
+
+    @staticmethod
+    def _cache_path(text: str, voice_id: str, voice_settings: VoiceSettings, model_id: str) -> Path:
+        """Cache file for a whole story: its text (whitespace-insensitive, segmentation does not matter)
+        plus everything else that affects the synthesized audio"""
+        key = orjson.dumps(
+            [" ".join(text.split()), voice_id, model_id, voice_settings.model_dump()],
+            option=orjson.OPT_SORT_KEYS
+        )
+        return Path(settings.TTS_CACHE_DIR) / f"{hashlib.sha256(key).hexdigest()}.mp3"
+
+    @staticmethod
+    def _read_cached_audio(path: Path) -> Optional[bytes]:
+        """Cached audio or None; a hit refreshes the file's mtime, which orders LRU eviction"""
         try:
-            logger.info(f"🎙️ Generating audio with voice {voice_id}")
-            
-            voice_settings = VoiceSettings(
-                stability=settings.ELEVENLABS_STABILITY,
-                similarity_boost=settings.ELEVENLABS_SIMILARITY_BOOST,
-                style=settings.ELEVENLABS_STYLE,
-                use_speaker_boost=settings.ELEVENLABS_USE_SPEAKER_BOOST
-            )
-            
-            audio_bytes = self.client.text_to_speech.convert(
-                text=text,
-                voice_id=voice_id,
-                voice_settings=voice_settings,
-                model_id=settings.ELEVENLABS_MODEL_ID
-            )
-            
-            # Convert generator to bytes
-            audio_data = b"".join(audio_bytes)
-            audio_buffer = BytesIO(audio_data)
-            audio_buffer.seek(0)
-            
-            logger.info(f"✅ Audio generated successfully: {len(audio_data)} bytes")
-            return audio_buffer
-            
-        except Exception as e:
-            msg = str(e).lower()
-            if "401" in msg or "unauthorized" in msg:
-                logger.info("TTS skipped: ElevenLabs unauthorized (401).")
-            else:
-                logger.error(f"❌ Error generating audio: {e}")
+            data = path.read_bytes()
+            os.utime(path)
+            return data
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to read TTS cache {path}: {e}")
             return None
 
+    @staticmethod
+    def _write_cached_audio(path: Path, data: bytes) -> None:
+        """Atomic write: readers never see a partially written file"""
+        if not data:
+            return
+        tmp_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to write TTS cache {path}: {e}")
+            tmp_path.unlink(missing_ok=True)
+            return
+        TTSService._prune_cache(path.parent, settings.TTS_CACHE_MAX_BYTES)
+
+    @staticmethod
+    def _prune_cache(directory: Path, max_bytes: int) -> None:
+        """Remove least recently used files until the cache fits in max_bytes"""
+        try:
+            files = []
+            for entry in os.scandir(directory):
+                if entry.name.endswith(".mp3"):
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError as e:
+            logger.warning(f"⚠️ Failed to scan TTS cache {directory}: {e}")
+            return
+        
+        total = sum(size for _, size, _ in files)
+        for _, size, file_path in sorted(files):
+            if total <= max_bytes:
+                break
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.warning(f"⚠️ Failed to evict TTS cache {file_path}: {e}")
+                continue
+            total -= size
+
     def _get_child_appropriate_voice(self, child_age: int) -> str:
         """
         Select appropriate voice based on child's age
@@ -181,31 +483,31 @@ class TTSService:
             # Школьники - чуть более взрослый голос
             return settings.ELEVENLABS_VOICE_ID
 
-    def _get_emotion_settings(self, mood: str) -> dict:
+    def _get_emotion_settings(self, mood: str) -> Mapping[str, float]:
         """
         Get voice settings based on story mood
         """
-        emotion_configs = {
-            "cheerful": {
-                "stability": 0.7,
-                "similarity_boost": 0.8,
-                "style": 0.3
-            },
-            "calm": {
-                "stability": 0.8,
-                "similarity_boost": 0.9,
-                "style": 0.1
-            },
-            "excited": {
-                "stability": 0.6,
-                "similarity_boost": 0.7,
-                "style": 0.4
-            },
-            "mysterious": {
-                "stability": 0.9,
-                "similarity_boost": 0.85,
-                "style": 0.2
-            }
-        }
-        
-        return emotion_configs.get(mood, emotion_configs["cheerful"])
\ No newline at end of file
+        return _EMOTION_SETTINGS.get(mood, _EMOTION_SETTINGS["cheerful"])
+
+
+# Process-wide instance: one connection pool for all TTS requests
+_tts_service: Optional[TTSService] = None
+
+
+def get_tts_service() -> TTSService:
+    """Get shared TTS service"""
+    global _tts_service
+    
+    if _tts_service is None:
+        _tts_service = TTSService()
+    
+    return _tts_service
+
+
+async def close_tts_service():
+    """Close shared TTS service (on application shutdown)"""
+    global _tts_service
+    
+    if _tts_service:
+        await _tts_service.close()
+        _tts_service = None
@@ -32,7 +32,7 @@ class UserService:
     
     async def get_user_stats(self, user_id: int) -> dict:
         """Get user statistics"""
-        user = await self.user_repo.get_by_id(user_id)
+        user, children_count = await self.user_repo.get_with_children_count(user_id)
         if not user:
             return {}
         
@@ -41,7 +41,7 @@ class UserService:
             "telegram_id": user.telegram_id,
             "first_name": user.first_name,
             "free_stories_used": user.free_stories_used,
-            "children_count": len(user.children) if user.children else 0,
+            "children_count": children_count,
             "is_active": user.is_active,
             "created_at": user.created_at
         }
@@ -1,12 +1,13 @@
 """Test tasks for Celery"""
-import time
 from ..core.celery_app import celery_app
 
 
-@celery_app.task
-def test_task(duration: int = 5):
+@celery_app.task(bind=True, max_retries=1)
+def test_task(self, duration: int = 5):
     """Тестовая задача для проверки Celery"""
-    time.sleep(duration)
+    # Wait via a delayed retry instead of sleeping, so the worker slot stays free meanwhile
+    if not self.request.retries:
+        raise self.retry(countdown=duration)
     return f"✅ Task completed after {duration} seconds"
 
 
@@ -0,0 +1,79 @@
+"""Blocked category matching: regex fallback and Aho-Corasick must agree with the per-category patterns"""
+import re
+from itertools import combinations
+
+import pytest
+
+from src.services.content_safety_service import (
+    ContentSafetyService,
+    _build_stem_automaton,
+    _compile_stem_regex,
+)
+
+
+@pytest.fixture(scope="module")
+def service():
+    return ContentSafetyService()
+
+
+def baseline_categories(service, text):
+    """Categories found by searching every category's original patterns one by one"""
+    return {
+        category
+        for category, patterns in service.blocked_patterns.items()
+        if any(re.search(pattern, text) for pattern in patterns)
+    }
+
+
+def sample_texts(service):
+    stems = sorted(service._blocked_stems)
+    words = [form for stem in stems for form in (stem, stem + "ами")]
+    texts = [
+        "убийца пришел ночью",
+        "они стали заниматься сексом",
+        "кровь из вен",
+        "маньяк-убийца",
+        "бомба и секта",
+        "сказка про зайца и лису",
+        "",
+    ]
+    texts += words
+    texts += [f"жил-был {first} и {second}" for first, second in combinations(stems[:40], 2)]
+    return texts
+
+
+@pytest.fixture(params=["regex", "aho-corasick"])
+def backend(request, service):
+    """The service with only the requested matcher, like the constructor builds it"""
+    saved = service._blocked_ac, service._blocked_regex
+    if request.param == "regex":
+        service._blocked_ac = None
+        service._blocked_regex = _compile_stem_regex(service._blocked_stems)
+    else:
+        pytest.importorskip("ahocorasick")
+        service._blocked_ac = _build_stem_automaton(service._blocked_stems)
+        service._blocked_regex = None
+    yield service
+    service._blocked_ac, service._blocked_regex = saved
+
+
+def test_blocked_categories_match_baseline(backend):
+    for text in sample_texts(backend):
+        assert set(backend._blocked_categories(text)) == baseline_categories(backend, text), text
+
+
+@pytest.mark.parametrize("text, category", [
+    ("убийца", "violence"),
+    ("убийца", "problematic_characters"),
+    ("заниматься сексом", "sexual"),
+    ("заниматься сексом", "profanity"),
+    ("кровь из вен", "violence"),
+    ("кровь из вен", "dangerous_actions"),
+])
+def test_overlapping_stems_keep_every_category(backend, text, category):
+    assert category in backend._blocked_categories(text)
+
+
+def test_stems_match_only_at_word_start(backend):
+    # "секс" inside a word is not a match, as \b in the original patterns
+    assert backend._blocked_categories("бессексный") == list(baseline_categories(backend, "бессексный"))
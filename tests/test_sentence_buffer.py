@@ -0,0 +1,79 @@
+"""Splitting streamed story text into sentences and TTS segments"""
+import asyncio
+
+from src.services.tts_service import TTS_SEGMENT_MAX_CHARS, SentenceBuffer, sentence_segments
+
+
+def split(text: str, size: int = 3):
+    buffer = SentenceBuffer()
+    sentences = []
+    for start in range(0, len(text), size):
+        sentences += buffer.add(text[start:start + size])
+    return sentences + buffer.flush()
+
+
+def test_sentences_are_returned_once_complete():
+    buffer = SentenceBuffer()
+    assert buffer.add("Жила-была лиса в лесу") == []
+    assert buffer.add(". Она была рыжая") == ["Жила-была лиса в лесу."]
+    assert buffer.flush() == ["Она была рыжая"]
+    assert buffer.flush() == []
+
+
+def test_streamed_text_keeps_every_character():
+    text = "Жила-была лиса. Она дружила с зайцем! Правда ли это? Конечно… «Да!» сказал заяц."
+    sentences = split(text)
+    assert " ".join(sentences) == text
+    assert sentences[0] == "Жила-была лиса."
+
+
+def test_abbreviations_and_initials_do_not_end_a_sentence():
+    text = "Автор сказки А. С. Пушкин, т.е. великий поэт. Читайте стр. пять и т.д. до конца."
+    assert split(text) == [
+        "Автор сказки А. С. Пушкин, т.е. великий поэт.",
+        "Читайте стр. пять и т.д. до конца.",
+    ]
+
+
+def test_short_sentences_stay_with_the_next_one():
+    assert split("Ой! Ах! Лиса убежала в лес. ") == ["Ой! Ах! Лиса убежала в лес."]
+
+
+def collect_segments(items):
+    """Segments produced when all items are already queued"""
+    async def collect():
+        queue: asyncio.Queue = asyncio.Queue()
+        for item in items:
+            queue.put_nowait(item)
+        return [segment async for segment in sentence_segments(queue)]
+    
+    return asyncio.run(collect())
+
+
+def test_queued_sentences_are_joined_into_one_segment():
+    assert collect_segments(["Первое.", "Второе.", None]) == ["Первое. Второе."]
+
+
+def test_segments_are_limited_in_size():
+    sentence = "а" * (TTS_SEGMENT_MAX_CHARS // 2) + "."
+    segments = collect_segments([sentence] * 5 + [None])
+    assert " ".join(segments) == " ".join([sentence] * 5)
+    assert len(segments) > 1
+    assert all(len(segment) < TTS_SEGMENT_MAX_CHARS + len(sentence) for segment in segments)
+
+
+def test_segments_are_yielded_as_sentences_arrive():
+    async def stream():
+        queue: asyncio.Queue = asyncio.Queue()
+        segments = sentence_segments(queue)
+        queue.put_nowait("Первое.")
+        first = await segments.__anext__()
+        queue.put_nowait("Второе.")
+        queue.put_nowait(None)
+        return first, [segment async for segment in segments]
+    
+    assert asyncio.run(stream()) == ("Первое.", ["Второе."])
+
+
+def test_none_ends_the_stream():
+    assert collect_segments([None]) == []
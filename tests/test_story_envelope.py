@@ -0,0 +1,64 @@
+"""Parsing of the {"story", "moral"} answer, whole and streamed"""
+import asyncio
+
+import orjson
+import pytest
+
+from src.services.openai_service import StoryEnvelopeStream, parse_story_envelope, _DEFAULT_MORALS
+
+
+def test_parse_story_and_moral():
+    content = orjson.dumps({"story": "Жила-была лиса.", "moral": " Дружба важна. "}).decode()
+    assert parse_story_envelope(content) == ("Жила-была лиса.", "Дружба важна.")
+
+
+@pytest.mark.parametrize("content", [
+    "Просто текст сказки без JSON.",
+    '{"moral": "без сказки"}',
+    '["story"]',
+    '{"story": 42}',
+])
+def test_unparseable_answer_is_the_story(content):
+    story_text, moral = parse_story_envelope(content)
+    assert story_text == content
+    assert moral in _DEFAULT_MORALS
+
+
+@pytest.mark.parametrize("moral", [None, "", "   ", 5])
+def test_missing_moral_gets_a_default(moral):
+    story_text, result = parse_story_envelope(orjson.dumps({"story": "Сказка.", "moral": moral}).decode())
+    assert story_text == "Сказка."
+    assert result in _DEFAULT_MORALS
+
+
+def feed_in_chunks(content: str, size: int) -> str:
+    """Text forwarded by StoryEnvelopeStream when content arrives in chunks of `size` characters"""
+    parts = []
+    
+    async def on_text(delta: str) -> None:
+        parts.append(delta)
+    
+    async def feed() -> None:
+        stream = StoryEnvelopeStream(on_text)
+        for start in range(0, len(content), size):
+            await stream.feed(content[start:start + size])
+    
+    asyncio.run(feed())
+    return "".join(parts)
+
+
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_stream_forwards_only_the_story(size):
+    story = 'Лиса сказала: "Привет!"\nИ ушла \\ домой 🦊.'
+    content = orjson.dumps({"story": story, "moral": "Будь вежлив."}).decode()
+    assert feed_in_chunks(content, size) == story
+
+
+@pytest.mark.parametrize("size", [1, 5])
+def test_stream_decodes_unicode_escapes_split_across_chunks(size):
+    content = '{"story": "\\u041b\\u0438\\u0441\\u0430 \\ud83e\\udd8a", "moral": "x"}'
+    assert feed_in_chunks(content, size) == "Лиса 🦊"
+
+
+def test_stream_without_story_field_forwards_nothing():
+    assert feed_in_chunks("Обычный текст без JSON.", 4) == ""